@@ -1,7 +1,15 @@
 import os
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+# 接受并透传关键字参数：SDK 的 with_options()/copy() 会用完整参数重新构造客户端
 class DeepSeek(OpenAI):
-    def __init__(self):
-        super().__init__(api_key=os.getenv("DEEPSEEK_API_KEY"), base_url='https://api.deepseek.com')
+    def __init__(self, **kwargs):
+        kwargs.setdefault("api_key", os.getenv("DEEPSEEK_API_KEY"))
+        kwargs.setdefault("base_url", 'https://api.deepseek.com')
+        super().__init__(**kwargs)
 
+class AsyncDeepSeek(AsyncOpenAI):
+    def __init__(self, **kwargs):
+        kwargs.setdefault("api_key", os.getenv("DEEPSEEK_API_KEY"))
+        kwargs.setdefault("base_url", 'https://api.deepseek.com')
+        super().__init__(**kwargs)
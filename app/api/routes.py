@@ -1,13 +1,14 @@
 # app/api/routes.py
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import Response
 from typing import List, Optional, Union
-import json
+import orjson
 import shutil
 import uuid
 from pathlib import Path
 
 from app.schemas import CharacterSheet, StoryCreateRequest, StoryResponse
-from app.services.story_generator import generate_story_from_text
+from app.services.story_generator import generate_story_from_text, generate_many
 # 引入新的函数名
 from app.services.pdf_service import parse_character_images
 from app.services.pdf_service import parse_monster_image 
@@ -15,41 +16,52 @@ from app.config import STORIES_DIR
 from app.schemas import SessionCreateRequest, GameSession
 from app.engine.session import session_manager
 from app.engine.ai_dm import ai_dm
-from app.schemas import GameActionRequest, DMResponse
+from app.schemas import GameActionRequest, DMResponse, DM_RESPONSE_ADAPTER
 router = APIRouter()
 
+
+def _dm_response(dm: DMResponse) -> Response:
+    """
+    回合接口直接返回 Response：跳过 FastAPI 按 response_model 的再校验/再序列化，
+    由预先构建的 adapter 在 pydantic-core 里一步导出 JSON bytes（不经过中间 dict）。
+    输出与 response_model=DMResponse 完全一致：空字段照常以 null 输出，和 OpenAPI 声明保持一致。
+    """
+    return Response(content=DM_RESPONSE_ADAPTER.dump_json(dm), media_type="application/json")
+
+
+def _json_response(content) -> Response:
+    """
+    没有 response_model 的普通 dict/list 结果：orjson 一步编码成 bytes 直接返回，
+    不经过 FastAPI 的 jsonable_encoder 再遍历一遍。
+    """
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+
+def _write_story(path: Path, story_data: dict) -> None:
+    """story.json 统一用 orjson 写回（2 空格缩进，UTF-8 原样输出，和原来的 json.dump 结果一致）"""
+    path.write_bytes(orjson.dumps(story_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
 # ==========================================
 # 1. 剧本管理 (Create & List & Get)
 # ==========================================
 
-@router.post("/stories/create", response_model=StoryResponse)
-def create_story(request: StoryCreateRequest):
+def _save_generated_story(title: str, story_graph_data: dict) -> StoryResponse:
+    """生成成功后才建目录并保存，生成失败时不会留下空壳"""
     # 1. 准备目录结构: data/stories/{uuid}/
     story_id = str(uuid.uuid4())[:8]
     story_folder = STORIES_DIR / story_id
-    story_folder.mkdir(parents=True, exist_ok=True)
     (story_folder / "images" / "enemies").mkdir(parents=True, exist_ok=True)
     (story_folder / "images" / "characters").mkdir(parents=True, exist_ok=True)
 
-    # 2. 生成逻辑
-    print(f"Using Dungeon Architect Prompt to generate: {request.title}...")
-    try:
-        story_graph_data = generate_story_from_text(request.raw_script)
-    except Exception as e:
-        # 发生错误时清理文件夹，避免留下空壳
-        shutil.rmtree(story_folder)
-        raise HTTPException(status_code=500, detail=f"LLM Generation Failed: {str(e)}")
-    
-    # 3. 补充元数据
+    # 2. 补充元数据
     story_graph_data["id"] = story_id
-    story_graph_data["title"] = request.title
+    story_graph_data["title"] = title
     if "characters" not in story_graph_data:
         story_graph_data["characters"] = []
     
-    # 4. 保存
+    # 3. 保存
     file_path = story_folder / "story.json"
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(story_graph_data, f, indent=2, ensure_ascii=False)
+    _write_story(file_path, story_graph_data)
 
     # 注意：这里 node_count 处理字典和列表的情况
     nodes = story_graph_data.get("nodes", {})
@@ -57,11 +69,39 @@ def create_story(request: StoryCreateRequest):
 
     return StoryResponse(
         id=story_id,
-        title=request.title,
+        title=title,
         node_count=count,
         file_path=str(file_path)
     )
 
+@router.post("/stories/create", response_model=StoryResponse)
+def create_story(request: StoryCreateRequest, no_cache: bool = False):
+    """no_cache=true：不复用缓存里的旧结果（例如改过剧本后想重新生成）"""
+    print(f"Using Dungeon Architect Prompt to generate: {request.title}...")
+    try:
+        story_graph_data = generate_story_from_text(request.raw_script, no_cache=no_cache)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"LLM Generation Failed: {str(e)}")
+
+    return _save_generated_story(request.title, story_graph_data)
+
+@router.post("/stories/batch")
+def create_stories_batch(requests: List[StoryCreateRequest], no_cache: bool = False):
+    """
+    一次提交多份剧本：embedding 一次批量算完，生成并行进行。
+    按输入顺序返回，每项是 StoryResponse，失败的项是 {"title", "error"}。
+    no_cache=true 对整批跳过缓存。
+    """
+    print(f"Batch generating {len(requests)} stories...")
+    results = generate_many([req.raw_script for req in requests], no_cache=no_cache)
+    response = []
+    for req, result in zip(requests, results):
+        if isinstance(result, Exception):
+            response.append({"title": req.title, "error": f"LLM Generation Failed: {result}"})
+        else:
+            response.append(_save_generated_story(req.title, result).model_dump())
+    return _json_response(response)
+
 @router.get("/stories")
 def list_stories():
     """
@@ -74,7 +114,7 @@ def list_stories():
     # 使用 rglob (recursive glob) 查找所有子目录下的 story.json
     for f in STORIES_DIR.rglob("story.json"):
         try:
-            d = json.loads(f.read_text(encoding="utf-8"))
+            d = orjson.loads(f.read_bytes())
             results.append({
                 "id": d.get("id"), 
                 "title": d.get("title", "Untitled Story")
@@ -83,7 +123,7 @@ def list_stories():
             print(f"Error loading {f}: {e}")
             continue
             
-    return results
+    return _json_response(results)
 
 @router.get("/stories/{story_id}")
 def get_story_details(story_id: str):
@@ -91,8 +131,8 @@ def get_story_details(story_id: str):
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Story not found")
     
-    with open(file_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # story.json 本身就是要返回的 JSON：原样返回文件内容，不解析也不重新序列化
+    return Response(content=file_path.read_bytes(), media_type="application/json")
 
 # ==========================================
 # 2. 工具接口 (Tools)
@@ -171,7 +211,7 @@ async def upload_enemy_image(
         
         # 调用 AI 解析
         try:
-            monster_sheet = parse_monster_image(stat_content, user_context=info or "")
+            monster_sheet = await parse_monster_image(stat_content, user_context=info or "")
             # 转为 Dict
             parsed_stats = monster_sheet.model_dump() if hasattr(monster_sheet, "model_dump") else monster_sheet
             # 把原图路径也存进 stats 里
@@ -182,8 +222,7 @@ async def upload_enemy_image(
             # raise HTTPException(500, detail=f"Parsing failed: {e}")
 
     # --- C. 更新 JSON ---
-    with open(json_path, "r", encoding="utf-8") as f:
-        story_data = json.load(f)
+    story_data = orjson.loads(json_path.read_bytes())
 
     updated = False
     nodes = story_data.get("nodes", {})
@@ -210,8 +249,7 @@ async def upload_enemy_image(
     if not updated:
         return {"warning": f"Enemy '{enemy_name}' not found in graph, but images saved if provided."}
 
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(story_data, f, indent=2, ensure_ascii=False)
+    _write_story(json_path, story_data)
 
     return {
         "status": "success", 
@@ -280,13 +318,13 @@ async def add_character_to_story(
 
     # --- C. 调用 AI 解析 (只解析 files，不解析 avatar) ---
     try:
-        char_data = parse_character_images(image_contents, user_context=background_info or "")
+        # 异步 Vision 调用：等待期间事件循环继续处理其他用户的请求
+        char_data = await parse_character_images(image_contents, user_context=background_info or "")
     except Exception as e:
         raise HTTPException(500, detail=f"AI Vision Failed: {str(e)}")
     
     # --- D. 更新 JSON ---
-    with open(json_path, "r", encoding="utf-8") as f:
-        story_data = json.load(f)
+    story_data = orjson.loads(json_path.read_bytes())
     
     if "characters" not in story_data:
         story_data["characters"] = []
@@ -301,8 +339,7 @@ async def add_character_to_story(
     
     story_data["characters"].append(char_dict)
     
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(story_data, f, indent=2, ensure_ascii=False)
+    _write_story(json_path, story_data)
 
     return {
         "status": "success", 
@@ -335,8 +372,7 @@ async def upload_scene_background(
         shutil.copyfileobj(file.file, buffer)
 
     # 3. 更新 JSON
-    with open(json_path, "r", encoding="utf-8") as f:
-        story_data = json.load(f)
+    story_data = orjson.loads(json_path.read_bytes())
 
     nodes = story_data.get("nodes", {})
     
@@ -350,8 +386,7 @@ async def upload_scene_background(
     # 更新节点的 image_path 字段
     nodes[node_id]["image_path"] = web_path
     
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(story_data, f, indent=2, ensure_ascii=False)
+    _write_story(json_path, story_data)
 
     return {"status": "success", "node_id": node_id, "image_path": web_path}
 
@@ -369,7 +404,7 @@ def create_new_session(request: SessionCreateRequest):
 
 @router.get("/sessions")
 def get_all_sessions():
-    return session_manager.list_sessions()
+    return _json_response(session_manager.list_sessions())
 
 @router.get("/sessions/{session_id}", response_model=GameSession)
 def get_session(session_id: str):
@@ -394,16 +429,15 @@ def get_session_render_data(session_id: str):
     if not story_path.exists():
         raise HTTPException(404, detail="Story file missing")
         
-    with open(story_path, "r", encoding="utf-8") as f:
-        story_data = json.load(f)
+    story_data = orjson.loads(story_path.read_bytes())
     
     current_node = story_data["nodes"].get(session.current_node_id)
     if not current_node:
-        return {"error": f"Node '{session.current_node_id}' not found."}
+        return _json_response({"error": f"Node '{session.current_node_id}' not found."})
 
     player = session.players[0]
     
-    return {
+    return _json_response({
         "session_id": session.session_id,
         "character": {
             "name": player.name,
@@ -418,19 +452,19 @@ def get_session_render_data(session_id: str):
             "type": current_node.get("type", "transition")
         },
         "history": session.chat_history
-    }
+    })
 
-@router.post("/sessions/{session_id}/action", response_model=DMResponse)
+@router.post("/sessions/{session_id}/action", responses={200: {"model": DMResponse}})
 def process_game_action(session_id: str, req: GameActionRequest):
     """正常推进剧情 (Action)"""
     try:
-        return ai_dm.process_turn(session_id, req.action)
+        return _dm_response(ai_dm.process_turn(session_id, req.action))
     except Exception as e:
         print(f"AI Error: {e}")
         raise HTTPException(500, detail=str(e))
     
 # --- 新增：询问接口 (Query) ---
-@router.post("/sessions/{session_id}/query", response_model=DMResponse)
+@router.post("/sessions/{session_id}/query", responses={200: {"model": DMResponse}})
 def process_game_query(session_id: str, req: GameActionRequest):
     """
     玩家提问 (Query)
@@ -438,7 +472,7 @@ def process_game_query(session_id: str, req: GameActionRequest):
     """
     try:
         # 调用 ai_dm 的新方法 (稍后实现)
-        return ai_dm.process_query(session_id, req.action)
+        return _dm_response(ai_dm.process_query(session_id, req.action))
     except Exception as e:
         print(f"AI Query Error: {e}")
         raise HTTPException(500, detail=str(e))
@@ -446,13 +480,13 @@ def process_game_query(session_id: str, req: GameActionRequest):
 # 引入新 Agent
 from app.engine.fight_agent import fight_agent
 
-@router.post("/sessions/{session_id}/fight", response_model=DMResponse)
+@router.post("/sessions/{session_id}/fight", responses={200: {"model": DMResponse}})
 def process_fight_turn(session_id: str, req: GameActionRequest):
     """
     专属战斗接口：严谨的回合制处理
     """
     try:
-        return fight_agent.process_fight_round(session_id, req.action)
+        return _dm_response(fight_agent.process_fight_round(session_id, req.action))
     except Exception as e:
         print(f"Fight Error: {e}")
         raise HTTPException(500, detail=str(e))
\ No newline at end of file
@@ -1,7 +1,18 @@
 # app/config.py
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # 指向根目录 AI-Dungeon-Master
 DATA_DIR = BASE_DIR / "data"
 STORIES_DIR = DATA_DIR / "stories"
-LIBRARY_DIR = DATA_DIR / "dnd_library"
\ No newline at end of file
+LIBRARY_DIR = DATA_DIR / "dnd_library"
+
+# 日志级别：默认 INFO，调试时可 LOG_LEVEL=DEBUG 打开 session 存取日志
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# 会话存档在进程内缓存 + 防抖写盘（app/engine/session.py），只支持单个 worker：
+# 多个 uvicorn worker 各有一份缓存和待写队列，会互相读到旧数据、覆盖对方的写入。
+# 部署时保持 `uvicorn app.main:app --workers 1`。
+# 防抖窗口（秒）：窗口内同一会话的多次保存只落盘最后一次；进程被强杀时窗口内的改动会丢，
+# 设为 0 则每次保存都同步写盘
+SESSION_SAVE_DEBOUNCE_SECONDS = float(os.getenv("SESSION_SAVE_DEBOUNCE_SECONDS", "0.2"))
@@ -2,30 +2,29 @@ import json
 import os
 from typing import Literal, Dict, Any
 
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 
-from app.engine.state import CombatAgentState
+from app.engine.state import CombatAgentState, cached_system_message
 from app.engine.session import session_manager
 from app.engine.combat import resolve_attack
 from app.config import STORIES_DIR
 from app.schemas import DMResponse
-from app.engine.i18n import get_text
+from app.engine.i18n import get_text, format_text
 
 # --- 1. Nodes ---
 
 def load_combat_context(state: CombatAgentState):
     """Load all necessary data for combat."""
-    session_id = state["session_id"]
+    session_id = state.session_id
     session = session_manager.load_session(session_id)
     player = session.players[0]
     lang = getattr(session, "language", "en")
     
     # Load Node
     story_path = STORIES_DIR / session.story_id / "story.json"
-    with open(story_path, "r", encoding="utf-8") as f:
-        story_data = json.load(f)
+    story_data = json.loads(story_path.read_bytes())
     current_node = story_data["nodes"].get(session.current_node_id, {})
     
     # Identify Enemy
@@ -88,7 +87,7 @@ def load_combat_context(state: CombatAgentState):
 def planner_node(state: CombatAgentState):
     """LLM decides actions for both sides."""
     # Check if combat over before planning
-    if state["enemy_data"]["hp"] <= 0:
+    if state.enemy_data["hp"] <= 0:
         return {
             "combat_plan": {"combat_state": {"should_end": True, "end_reason": "enemy_dead"}},
             "active_mode": "action"
@@ -115,14 +114,14 @@ def planner_node(state: CombatAgentState):
     """
     
     context = {
-        "player": state["player_data"],
-        "enemy": state["enemy_data"],
-        "last_narration": state["last_dm_narration"],
-        "player_input": state["player_input"]
+        "player": state.player_data,
+        "enemy": state.enemy_data,
+        "last_narration": state.last_dm_narration,
+        "player_input": state.player_input
     }
     
     msgs = [
-        SystemMessage(content=PLANNER_PROMPT),
+        cached_system_message(PLANNER_PROMPT),
         HumanMessage(content=f"Context: {json.dumps(context)}")
     ]
     
@@ -143,13 +142,13 @@ def planner_node(state: CombatAgentState):
 
 def simulator_node(state: CombatAgentState):
     """Execute the plan using Python logic."""
-    plan = state.get("combat_plan", {})
+    plan = state.combat_plan
     if not plan:
         return {}
         
-    player = state["player_data"]
-    enemy = state["enemy_data"]
-    lang = state["language"]
+    player = state.player_data
+    enemy = state.enemy_data
+    lang = state.language
     
     player_action = plan.get("player_action", {})
     enemy_action = plan.get("enemy_action", {})
@@ -223,13 +222,13 @@ def simulator_node(state: CombatAgentState):
 
 def narrator_node(state: CombatAgentState):
     """Generate vivid description."""
-    summary = state.get("round_summary")
-    lang = state["language"]
+    summary = state.round_summary
+    lang = state.language
     
     # If combat ended early (e.g. enemy already dead)
     if not summary:
-        if state.get("combat_plan", {}).get("combat_state", {}).get("end_reason") == "enemy_dead":
-             msg = get_text(lang, "dm_context", "defeated_msg").format(enemy_name=state["enemy_data"]["name"])
+        if state.combat_plan.get("combat_state", {}).get("end_reason") == "enemy_dead":
+             msg = format_text(lang, "dm_context", "defeated_msg", enemy_name=state.enemy_data["name"])
              return {"final_narrative": msg, "active_mode": "action"}
         return {"final_narrative": "Combat logic error.", "active_mode": "fight"}
 
@@ -244,7 +243,7 @@ def narrator_node(state: CombatAgentState):
         
     sys_prompt = get_text(lang, "fight_narrator_system")
     msgs = [
-        SystemMessage(content=sys_prompt),
+        cached_system_message(sys_prompt),
         HumanMessage(content=f"Round Summary: {json.dumps(summary, default=str)}")
     ]
     
@@ -262,8 +261,8 @@ def narrator_node(state: CombatAgentState):
     
 def update_session(state: CombatAgentState):
     """Commit changes to DB."""
-    session = session_manager.load_session(state["session_id"])
-    summary = state.get("round_summary", {})
+    session = session_manager.load_session(state.session_id)
+    summary = state.round_summary
     
     if summary:
         # Update Player
@@ -277,7 +276,7 @@ def update_session(state: CombatAgentState):
         # Calculate TOTAL damage taken from max_hp
         # Since we only have 'hp_after' here, we need to be careful.
         # Actually easier: Max HP - Current HP = Total Damage
-        # We need Max HP. It was in state["enemy_data"]["max_hp"].
+        # We need Max HP. It was in state.enemy_data["max_hp"].
         # But we don't have direct access to that input here unless we passed it through.
         # Simulator node calculated hp_after.
         
@@ -287,10 +286,10 @@ def update_session(state: CombatAgentState):
         session.enemy_states[enemy_name] = {"damage_taken": new_total_damage}
         
     # Append History
-    session.chat_history.append({"role": "user", "content": f"[Fight] {state['player_input']}"})
-    if state.get("mechanics_log"):
-        session.chat_history.append({"role": "data", "content": state["mechanics_log"]})
-    session.chat_history.append({"role": "assistant", "content": state.get("final_narrative", "")})
+    session.chat_history.append({"role": "user", "content": f"[Fight] {state.player_input}"})
+    if state.mechanics_log:
+        session.chat_history.append({"role": "data", "content": state.mechanics_log})
+    session.chat_history.append({"role": "assistant", "content": state.final_narrative})
     
     session_manager.save_session(session)
     return {}
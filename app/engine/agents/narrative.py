@@ -8,12 +8,12 @@ from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 
-from app.engine.state import NarrativeAgentState
+from app.engine.state import NarrativeAgentState, cached_system_message
 from app.engine.session import session_manager
 from app.engine.combat import roll_dice
 from app.config import STORIES_DIR
 from app.schemas import DMResponse
-from app.engine.i18n import get_text
+from app.engine.i18n import get_text, format_text
 
 # --- 1. Tools Definition ---
 
@@ -48,14 +48,13 @@ def load_context(state: NarrativeAgentState):
     """
     Load session, player, story node, and build System Prompt + Context.
     """
-    session_id = state["session_id"]
+    session_id = state.session_id
     session = session_manager.load_session(session_id)
     player = session.players[0]
     lang = getattr(session, "language", "en")
     
     story_path = STORIES_DIR / session.story_id / "story.json"
-    with open(story_path, "r", encoding="utf-8") as f:
-        story_data = json.load(f)
+    story_data = json.loads(story_path.read_bytes())
     current_node = story_data["nodes"].get(session.current_node_id)
     
     # Pacing Logic - READ ONLY (Increment handled by Wrapper)
@@ -80,7 +79,7 @@ def load_context(state: NarrativeAgentState):
         
     pacing_instruction = get_text(lang, "dm_context", "pacing_go")
     if session.current_node_turns < min_turns:
-        pacing_instruction = get_text(lang, "dm_context", "pacing_wait").format(turns=session.current_node_turns, min_turns=min_turns)
+        pacing_instruction = format_text(lang, "dm_context", "pacing_wait", turns=session.current_node_turns, min_turns=min_turns)
 
     context = f"""
     --- PLAYER ---
@@ -106,7 +105,7 @@ def load_context(state: NarrativeAgentState):
     --- INSTRUCTIONS ---
     {pacing_instruction}
     
-    Player says: "{state['player_input']}"
+    Player says: "{state.player_input}"
     """
     
     system_prompt = get_text(lang, "system_dm")
@@ -153,7 +152,7 @@ def call_model(state: NarrativeAgentState):
     llm_with_tools = llm.bind_tools([ABILITY_CHECK_DEF])
     
     # Construct messages: System + History + User Context
-    all_msgs = [SystemMessage(content=state["system_prompt"])] + state["messages"]
+    all_msgs = [cached_system_message(state.system_prompt)] + state.messages
     
     response = llm_with_tools.invoke(all_msgs)
     return {"messages": [response]}
@@ -162,13 +161,13 @@ def execute_tools(state: NarrativeAgentState):
     """
     Custom tool execution node.
     """
-    last_msg = state["messages"][-1]
+    last_msg = state.messages[-1]
     tool_calls = last_msg.tool_calls
     
     new_messages = []
     new_logs = []
     
-    session = session_manager.load_session(state["session_id"])
+    session = session_manager.load_session(state.session_id)
     player = session.players[0]
     lang = getattr(session, "language", "en")
     
@@ -226,7 +225,7 @@ def parse_output(state: NarrativeAgentState):
     
     The current prompt asks for JSON. So the last message content should be JSON.
     """
-    last_msg = state["messages"][-1]
+    last_msg = state.messages[-1]
     content = last_msg.content
     
     try:
@@ -253,7 +252,7 @@ def parse_output(state: NarrativeAgentState):
 # --- 3. Build Graph ---
 
 def should_continue(state: NarrativeAgentState) -> Literal["execute_tools", "parse_output"]:
-    last_msg = state["messages"][-1]
+    last_msg = state.messages[-1]
     if last_msg.tool_calls:
         return "execute_tools"
     return "parse_output"
@@ -17,7 +17,7 @@ from app.engine.session import session_manager
 from app.schemas import DMResponse
 from app.config import STORIES_DIR
 from app.engine.agent_workflow import answer_query
-from app.engine.i18n import get_text
+from app.engine.i18n import get_text, format_text
 
 # NEW: Import LangGraph Workflow
 from app.engine.agents.narrative import narrative_graph
@@ -72,8 +72,7 @@ class DungeonMasterAI:
         
         lang = getattr(session, "language", "en")
         story_path = STORIES_DIR / session.story_id / "story.json"
-        with open(story_path, "r", encoding="utf-8") as f:
-            story_data = json.load(f)
+        story_data = json.loads(story_path.read_bytes())
             
         current_node = story_data["nodes"].get(session.current_node_id)
         
@@ -132,10 +131,10 @@ class DungeonMasterAI:
                 attacks_block = "\n".join(attack_lines) if attack_lines else get_text(lang, "dm_narrative", "no_attacks")
 
                 # 战斗开场白
-                t_begins = get_text(lang, "dm_narrative", "combat_begins").format(enemy_name=enemy_name)
+                t_begins = format_text(lang, "dm_narrative", "combat_begins", enemy_name=enemy_name)
                 t_hp = ""
                 if enemy_hp_max != "unknown":
-                    t_hp = get_text(lang, "dm_narrative", "enemy_hp").format(enemy_name=enemy_name, hp=enemy_hp_max)
+                    t_hp = format_text(lang, "dm_narrative", "enemy_hp", enemy_name=enemy_name, hp=enemy_hp_max)
                 
                 t_attacks = get_text(lang, "dm_narrative", "attacks_header")
                 t_prompt = get_text(lang, "dm_narrative", "combat_prompt")
@@ -0,0 +1,41 @@
+# app/engine/character_store.py
+import functools
+import hashlib
+
+import orjson
+
+from app.config import DATA_DIR
+from app.schemas import CharacterSheet
+
+# 角色卡是静态数据：每张卡只在这里存一份，会话里的 PlayerState 只记 character_sheet_id。
+# id 取内容哈希，同一剧本的同一角色在多个会话之间自动复用同一个文件。
+# 目录在第一次保存时才创建，导入本模块没有副作用
+SHEETS_DIR = DATA_DIR / "character_sheets"
+
+
+def save_sheet(sheet: CharacterSheet) -> str:
+    """保存角色卡（已存在则跳过），返回它的 id"""
+    data = orjson.dumps(sheet.model_dump(mode="json"), option=orjson.OPT_SORT_KEYS)
+    sheet_id = hashlib.blake2b(data, digest_size=8).hexdigest()
+    path = SHEETS_DIR / f"{sheet_id}.json"
+    if not path.exists():
+        SHEETS_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return sheet_id
+
+
+@functools.lru_cache(maxsize=512)
+def _load_sheet(sheet_id: str) -> CharacterSheet:
+    """按 id 读取角色卡，解析和校验只做一次；返回的是缓存里的共享实例"""
+    path = SHEETS_DIR / f"{sheet_id}.json"
+    if not path.exists():
+        raise FileNotFoundError(f"Character sheet {sheet_id} not found")
+    return CharacterSheet(**orjson.loads(path.read_bytes()))
+
+
+def get_sheet(sheet_id: str) -> CharacterSheet:
+    """
+    按 id 取角色卡。多个会话可能引用同一张卡：返回深拷贝，
+    调用方修改它不会影响缓存，也不会影响其它会话。
+    """
+    return _load_sheet(sheet_id).model_copy(deep=True)
@@ -20,7 +20,7 @@ import random
 import re
 from pathlib import Path
 from typing import Any, Dict, List, Optional
-from app.engine.i18n import get_text # <--- Import i18n
+from app.engine.i18n import get_text, compiled_combat # <--- Import i18n
 
 
 # ---------------------------------------------------------------------------
@@ -383,14 +383,14 @@ def resolve_attack(
     # 构建日志 - using i18n
     log_parts = []
     
-    t_attack = get_text(lang, "combat_log", "attack").format(attacker=attacker_name, target=target_name, weapon=attack_name)
+    t_attack = compiled_combat(lang, "attack")(attacker=attacker_name, target=target_name, weapon=attack_name)
     log_parts.append(t_attack)
     
     hit_status = get_text(lang, "combat_log", "miss")
     if is_crit: hit_status = get_text(lang, "combat_log", "crit")
     elif is_hit: hit_status = get_text(lang, "combat_log", "hit")
     
-    t_roll = get_text(lang, "combat_log", "roll").format(d20=d20_val, bonus=attack_bonus, total=total_hit, ac=target_ac, result=hit_status)
+    t_roll = compiled_combat(lang, "roll")(d20=d20_val, bonus=attack_bonus, total=total_hit, ac=target_ac, result=hit_status)
     log_parts.append(t_roll)
 
     damage_total = 0
@@ -400,10 +400,10 @@ def resolve_attack(
         
         if is_crit:
             damage_total *= 2
-            t_dmg = get_text(lang, "combat_log", "damage_crit").format(expr=dmg_roll['normalized'], total=damage_total)
+            t_dmg = compiled_combat(lang, "damage_crit")(expr=dmg_roll['normalized'], total=damage_total)
             log_parts.append(t_dmg)
         else:
-            t_dmg = get_text(lang, "combat_log", "damage").format(expr=dmg_roll['normalized'], total=damage_total)
+            t_dmg = compiled_combat(lang, "damage")(expr=dmg_roll['normalized'], total=damage_total)
             log_parts.append(t_dmg)
     else:
         t_block = get_text(lang, "combat_log", "block")
@@ -1,299 +1,103 @@
+import functools
+import importlib
+import string
 
-PROMPTS = {
-    "en": {
-        "system_dm": """
-You are an expert Dungeon Master running a D&D 5e adventure.
+__all__ = ["get_text", "format_text", "compiled_combat"]
 
-### YOUR RESPONSIBILITY
-You are responsible for:
-- Narrative description and roleplay.
-- Scene pacing and node transitions in the story graph.
-- Light, non-combat dice checks (ability checks, skill checks, saving throws, etc.).
-
-You are **NOT** responsible for:
-- Detailed combat math for each round.
-- Applying damage to HP or tracking exact HP values.
-- Managing initiative order or turn-by-turn combat resolution.
-- Controlling any UI mode or frontend tabs (such as 'action' or 'fight'). The game engine will handle UI modes based on your chosen `transition_to_id` and the node types.
-
-
-All detailed combat (attack rolls, damage, HP updates, enemy HP, etc.)
-is handled by a separate **combat agent** on the `/fight` endpoint.
-
-### RULES
-1. **Narrative**:
-   - Be vivid and grounded in the current node's description and GM guidance.
-   - When entering a new scene, briefly describe the environment, key NPCs/monsters, and immediate sensory details.
-   - Always provide player with options based on the scene's "PLAYER OPTIONS" section, guide them to choose one.
-
-2. **Dice / Ability Checks**:
-   - For any NON-COMBAT uncertain outcome (spotting details, persuading NPCs, sneaking, recalling lore, etc.),
-     you MUST use the `ability_check` tool.
-   - You may ONLY use the following abilities for checks:
-     strength, dexterity, constitution, intelligence, wisdom, charisma.
-   - Choose ONE ability, an appropriate DC, and a clear `reason` describing what the character is attempting and why
-     this check is required.
-   - The game engine will automatically:
-       * look up the character's actual ability score,
-       * compute the modifier,
-       * roll 1d20 + modifier,
-       * and determine success or failure.
-   - You do NOT need to invent the dice expression or do math yourself.
-
-3. **Transitions**:
-   - Use `transition_to_id` only when it logically follows to move to another node.
-   - Respect pacing instructions: if the scene has not yet met its minimum turns, stay unless the PLAYER clearly insists on leaving or forcing a transition.
-4. **Combat Handoff**:
-   - You can describe threats, weapons being drawn, and the first moments of battle.
-   - When you decide that combat should begin, choose a `transition_to_id` that points to a combat node in the story graph.
-   - Do NOT apply HP changes yourself; leave `damage_taken` as 0 or only very minor narrative chip damage if absolutely necessary.
-
-
-### OUTPUT FORMAT (JSON)
-You MUST always return a JSON object matching this schema:
-
-{
-  "narrative": "What you say to the player, describing the scene and consequences.",
-  "mechanics_log": "Any dice or mechanical notes. Can be empty string if nothing to log.",
-  "damage_taken": 0,
-  "transition_to_id": "node_id or null",
+# 每种语言的 prompt 树放在独立模块里（prompts_en.py / prompts_zh.py），
+# 第一次用到某种语言时才 import，进程只常驻实际用到的语言。
+_PROMPT_MODULES = {
+    "en": "prompts_en",
+    "zh": "prompts_zh",
 }
 
-- `damage_taken`: For you, this should normally stay 0. HP changes are mainly the combat agent's job.
-- `transition_to_id`: Either null (remain in this node) or a node id from the provided list of possible next node ids.
-""",
-        "system_rule_assistant": """
-[You are AIDND Assistant]
-You MUST follow this ReACT tool-calling protocol. When you need data from the local catalog or Open5e, you MUST call tools.
-Do NOT narrate or describe your intentions. Instead, output exactly one tool call block:
-  <CALL>{"fn":"function_name","args":{...}}</CALL>
-After the system executes the tool, it will append a system message beginning with:
-  Observation: { ... }
-You may think again, optionally call more tools, and ONLY AFTER calling fetch_and_cache, produce the final user-facing answer.
-Never include <CALL> in your final answer.
-
-Available functions:
-- look_monster_table(query:str, limit:int=20)
-- search_table(type:str, name_or_slug:str, prefer_doc:str|None)
-- fetch_and_cache(type:str, slug:str)
-
-Supported resource types (for search_table & fetch_and_cache):
-  monsters, spells, equipment, backgrounds, classes,
-  conditions, documents, feats, planes, races,
-  sections, spelllist
-""",
-        "combat_log": {
-             "attack": "⚔️ **{attacker}** attacks **{target}** with *{weapon}*.",
-             "hit": "HIT",
-             "miss": "MISS",
-             "crit": "CRITICAL HIT!",
-             "roll": "🎲 To Hit: 1d20({d20}) + {bonus} = **{total}** vs AC {ac} -> **{result}**",
-             "damage": "🩸 Damage: {expr} = **{total}**",
-             "damage_crit": "💥 Damage (Crit x2): {expr} = **{total}**",
-             "block": "🛡️ Attack was blocked or dodged."
-        },
-        "dm_log": {
-             "check_title": "Ability Check",
-             "reason": "Reason",
-             "ability": "Ability",
-             "dc": "DC",
-             "result": "Result"
-        },
-        "dm_narrative": {
-             "combat_begins": "\n\n[Combat Begins]\n{enemy_name} shows dangerous intent!\n",
-             "enemy_hp": "your {enemy_name} (approximately {hp} HP).\n",
-             "attacks_header": "\nYour main attacks are:\n",
-             "no_attacks": "（you don't have any registered attacks on your character sheet.）",
-             "combat_prompt": "Describe your first combat action (e.g., 'I attack with my longsword' or 'I cast a fireball')."
-        },
-        "fight_narrator_system": """
-You are a vivid but RULE-RESPECTING D&D 5e combat narrator.
-
-You will be given:
-- The structured summary of this combat round.
-- Which attacks were attempted, which hit, and how much damage was dealt.
-- HP of each side before and after the round.
+@functools.lru_cache(maxsize=2)
+def _load_prompts(lang: str) -> dict:
+    return importlib.import_module(f"{__package__}.{_PROMPT_MODULES[lang]}").PROMPTS
 
-Your job:
-- Describe ONLY what actually happened according to the provided data.
-- Do NOT invent extra attacks, spells, or effects.
-- Do NOT change HP numbers; just describe them.
-- Use 2-5 sentences, 2nd person ("you").
-- Always end by briefly asking the player what they do next.
-
-Example ending:
-"Bloodied but unbroken, you still stand. What do you do now?"
-""",
-        "dm_context": {
-             "edges_default": "No explicit transitions are defined from this node.",
-             "options_default": "No explicit options are defined. You may still infer reasonable actions from the scene.",
-             "interactions_default": "No explicit interaction blueprints are defined.",
-             "pacing_wait": "[PACING] Player has spent {turns}/{min_turns} turns in this scene.\nStay in this node unless the PLAYER clearly asks to move on or leave.\n",
-             "pacing_go": "[PACING] Player has spent enough time in current scene.\nYou MAY transition to another node if it feels natural for the story.\nIf you decide to leave this node, set transition_to_id to ONE id from the list under 'POSSIBLE NEXT NODE IDS'. You MUST NOT invent new node ids.If 'POSSIBLE NEXT NODE IDS'. is empty, it means the end of the story has been reached. And you should inform the player that the adventure concludes here, give them a satisfying ending, and do NOT set transition_to_id.",
-             "no_hostiles": "There are no hostile monsters here. Combat seems to be over.",
-             "defeated_msg": "{enemy_name} already lies defeated. There is nothing left to fight here.",
-             "victory_system": "\n\n(System: {enemy_name} has been defeated!)",
-             "defeat_system": "\n\n(System: You fall to 0 HP and drop unconscious.)"
-        }
-    },
-    "zh": {
-        "system_dm": """
-你是一位经验丰富的地下城主（DM），正在主持一场 D&D 5e 冒险。
-
-### 你的职责
-你需要负责：
-- 叙事描述和角色扮演。
-- 场景节奏控制和故事图的节点跳转。
-- 轻量级的非战斗骰子检定（属性检定、技能检定、豁免检定等）。
-
-你 **不负责**：
-- 每轮详细的战斗数值计算。
-- 扣除 HP 或追踪精确的 HP 数值。
-- 管理先攻顺序或逐回合的战斗结算。
-- 控制任何 UI 模式或前端标签页（如 'action' 或 'fight'）。游戏引擎会根据你选择的 `transition_to_id` 和节点类型处理 UI 模式。
-
-所有详细的战斗（攻击检定、伤害、HP 更新、敌人 HP 等）
-都由单独的 **战斗代理（combat agent）** 在 `/fight` 端点处理。
-
-### 语言要求
-- **你必须始终用中文（简体中文）回复。**
-- 在适当的时候将游戏术语（如 Ability Check, Saving Throw 等）翻译成中文，但对于特定的专有名词（如 "Waterdeep" 或 "Neverwinter"），如果翻译有歧义，可以保留英文或提供中英对照。
-- 叙事风格应具有沉浸感，就像一部奇幻小说。
+@functools.lru_cache(maxsize=None)
+def get_text(lang: str, category: str, key: str = None) -> str | dict:
+    """
+    Retrieve localized text.
+    Usage:
+      get_text("zh", "system_dm") -> returns full prompt
+      get_text("zh", "combat_log", "attack") -> returns specific format string
 
-### 规则
-1. **叙事**：
-   - 描述要生动，并基于当前节点的描述和 GM 指导。
-   - 当进入新场景时，简要描述环境、关键 NPC/怪物和直接的感官细节。
-   - 始终根据场景的 "PLAYER OPTIONS" 部分向玩家提供选项，引导他们做出选择。
+    Results are memoized per (lang, category, key). When a whole category
+    dict is returned it is the shared prompt-tree entry: treat it as read-only.
+    """
+    lang = lang if lang in _PROMPT_MODULES else "en"
+    cat_data = _load_prompts(lang).get(category)
+    if not cat_data:
+        # Fallback to English if category missing
+        cat_data = _load_prompts("en").get(category)
+    
+    if key and isinstance(cat_data, dict):
+        return cat_data.get(key, _load_prompts("en")[category].get(key, ""))
+    
+    return cat_data
 
-2. **骰子 / 属性检定**：
-   - 对于任何 **非战斗** 的不确定结果（发现细节、说服 NPC、潜行、回忆传说等），
-     你 **必须** 使用 `ability_check` 工具。
-   - 你只能使用以下属性进行检定：
-     strength (力量), dexterity (敏捷), constitution (体质), intelligence (智力), wisdom (感知), charisma (魅力)。
-   - 选择 **一个** 属性，一个合适的 DC，并提供一个明确的 `reason`（原因），描述角色试图做什么以及为什么需要这次检定。
-   - 游戏引擎会自动：
-       * 查找角色的实际属性值，
-       * 计算调整值，
-       * 投掷 1d20 + 调整值，
-       * 并确定成功或失败。
-   - 你不需要自己发明骰子表达式或进行数学计算。
 
-3. **跳转**：
-   - 只有在逻辑上顺畅时才使用 `transition_to_id` 移动到另一个节点。
-   - 遵守节奏指令：如果场景尚未达到最小回合数，除非玩家明确坚持离开或强行跳转，否则请停留在当前节点。
+@functools.lru_cache(maxsize=512)
+def _fmt(lang: str, category: str, key: str, **kw) -> str:
+    return get_text(lang, category, key).format(**kw)
 
-4. **战斗移交**：
-   - 你可以描述威胁、武器拔出和战斗的最初时刻。
-   - 当你决定战斗应该开始时，选择一个指向故事图中战斗节点的 `transition_to_id`。
-   - **不要** 自己应用 HP 变更；让 `damage_taken` 保持为 0，或者如果绝对必要，只造成非常轻微的叙事性伤害。
 
-### 输出格式 (JSON)
-你必须始终返回一个符合此模式的 JSON 对象：
+def format_text(lang: str, category: str, key: str, **kw) -> str:
+    """
+    get_text(...).format(**kw), memoized on the full argument set.
+    Combat/narrative lines like `combat_begins` repeat with the same enemy
+    all session long, so the formatted string is cached.
+      format_text("zh", "dm_narrative", "enemy_hp", enemy_name="Goblin", hp=7)
+    """
+    try:
+        hash(tuple(kw.values()))
+    except TypeError:
+        # 不可哈希的参数（来自 story.json 的 dict/list）不能做缓存 key：直接格式化
+        return get_text(lang, category, key).format(**kw)
+    # 其它错误（参数类型不对、模板字段缺失等）照常抛出
+    return _fmt(lang, category, key, **kw)
 
-{
-  "narrative": "你对玩家说的话，描述场景和后果（用中文）。",
-  "mechanics_log": "任何骰子或机制说明。如果没有要记录的内容，可以为空字符串。",
-  "damage_taken": 0,
-  "transition_to_id": "node_id 或 null",
-}
 
-- `damage_taken`: 对你来说，这通常应保持为 0。HP 变更主要是战斗代理的工作。
-- `transition_to_id`: 要么是 null（停留在当前节点），要么是提供的可能下一个节点 ID 列表中的一个节点 ID。
-""",
-        "system_rule_assistant": """
-[你是 AIDND 助手]
-你是一个 D&D 5e 规则助手。你 **必须** 用中文（简体中文）回答用户的问题。
-你必须遵循此 ReACT 工具调用协议。当你需要来自本地目录或 Open5e 的数据时，你必须调用工具。
-不要叙述或描述你的意图。相反，只输出一个工具调用块：
-  <CALL>{"fn":"function_name","args":{...}}</CALL>
-系统执行工具后，会追加一条以以下内容开头的系统消息：
-  Observation: { ... }
-你可以再次思考，选择性地调用更多工具，并且 **仅在** 调用 fetch_and_cache 之后，生成最终面向用户的答案。
-永远不要在最终答案中包含 <CALL>。
-最终答案要求：虽然你在思考时使用工具调用，但你最终的自然语言回复 **必须** 是中文。
+# ---------------------------------------------------------------------------
+# Precompiled combat log templates
+# ---------------------------------------------------------------------------
 
-可用函数：
-- look_monster_table(query:str, limit:int=20)
-- search_table(type:str, name_or_slug:str, prefer_doc:str|None)
-- fetch_and_cache(type:str, slug:str)
+def _compile_template(tmpl: str):
+    """
+    Compile a ``str.format`` template into a plain function once, so that
+    formatting a combat log line no longer re-parses the template.
+      _compile_template("{a} hits {b}")(a="X", b="Y") -> "X hits Y"
+    Like ``str.format``, extra keyword arguments the template does not use
+    are accepted and ignored (the generated function takes ``**_unused``).
+    """
+    params = []
+    for _, field_name, _, _ in string.Formatter().parse(tmpl):
+        if field_name is None or field_name in params:
+            continue
+        if not field_name.isidentifier():
+            # Positional / attribute fields: keep the regular formatter
+            return lambda **kw: tmpl.format(**kw)
+        params.append(field_name)
 
-支持的资源类型 (用于 search_table & fetch_and_cache):
-  monsters, spells, equipment, backgrounds, classes,
-  conditions, documents, feats, planes, races,
-  sections, spelllist
-""",
-        "combat_log": {
-             "attack": "⚔️ **{attacker}** 使用 *{weapon}* 攻击 **{target}**。",
-             "hit": "命中 (HIT)",
-             "miss": "未命中 (MISS)",
-             "crit": "暴击 (CRITICAL HIT)!",
-             "roll": "🎲 命中检定: 1d20({d20}) + {bonus} = **{total}** vs AC {ac} -> **{result}**",
-             "damage": "🩸 伤害: {expr} = **{total}**",
-             "damage_crit": "💥 伤害 (暴击 x2): {expr} = **{total}**",
-             "block": "🛡️ 攻击被格挡或闪避。"
-        },
-        "dm_log": {
-             "check_title": "能力检定 (Ability Check)",
-             "reason": "原因",
-             "ability": "属性",
-             "dc": "DC",
-             "result": "结果"
-        },
-        "dm_narrative": {
-             "combat_begins": "\n\n[战斗开始]\n{enemy_name} 表现出危险的意图！\n",
-             "enemy_hp": "你的 {enemy_name} (大约 {hp} HP)。\n",
-             "attacks_header": "\n你的主要攻击方式有：\n",
-             "no_attacks": "（你的角色卡上没有注册任何攻击方式。）",
-             "combat_prompt": "请描述你的战斗行动（例如：“我用长剑攻击”或“我施放火球术”）。"
-        },
-        "fight_narrator_system": """
-你是一个生动但严格遵守规则的 D&D 5e 战斗解说员。
+    namespace = {}
+    if params:
+        exec(f"def _f({', '.join(params)}, **_unused): return f{tmpl!r}", namespace)
+    else:
+        exec(f"def _f(**_unused): return {tmpl!r}", namespace)
+    return namespace["_f"]
 
-你将收到：
-- 本回合战斗的结构化摘要。
-- 尝试了哪些攻击，哪些命中，以及造成了多少伤害。
-- 回合前后双方的 HP。
 
-你的工作：
-- **仅** 描述根据提供的数据实际发生的事情。
-- **不要** 发明额外的攻击、法术或效果。
-- **不要** 更改 HP 数值；只是描述它们。
-- 使用 2-5 个句子，第二人称（“你”）。
-- 始终以简短地询问玩家接下来做什么作为结尾。
-- **必须使用中文（简体中文）进行描述。**
+@functools.lru_cache(maxsize=2)
+def _compiled_combat_table(lang: str) -> dict:
+    return {key: _compile_template(tmpl) for key, tmpl in _load_prompts(lang)["combat_log"].items()}
 
-结尾示例：
-“浑身是血但这并未击垮你，你依然屹立不倒。你现在要做什么？”
-""",
-        "dm_context": {
-             "edges_default": "此节点未定义明确的跳转。",
-             "options_default": "未定义明确的选项。你仍然可以根据场景推断合理的行动。",
-             "interactions_default": "未定义明确的交互蓝图。",
-             "pacing_wait": "[节奏控制] 玩家已在此场景中度过 {turns}/{min_turns} 回合。\n除非玩家明确要求继续或离开，否则请留在当前节点。\n",
-             "pacing_go": "[节奏控制] 玩家在当前场景中已度过足够的时间。\n如果觉得对故事自然，你可以跳转到另一个节点。\n如果你决定离开此节点，请将 transition_to_id 设置为 'POSSIBLE NEXT NODE IDS' 列表下的一个 ID。你绝不能发明新的节点 ID。如果 'POSSIBLE NEXT NODE IDS' 为空，意味着故事结束。你应该告知玩家冒险在此结束，给出一个满意的结局，并且不要设置 transition_to_id。",
-             "no_hostiles": "这里没有敌对怪物。战斗似乎已经结束。",
-             "defeated_msg": "{enemy_name} 已经被击败。这里没有什么可打的了。",
-             "victory_system": "\n\n(系统: {enemy_name} 已被击败!)",
-             "defeat_system": "\n\n(系统: 你倒下了，生命值归零，陷入昏迷。)"
-        }
-    }
-}
 
-def get_text(lang: str, category: str, key: str = None) -> str | dict:
+def compiled_combat(lang: str, key: str):
     """
-    Retrieve localized text.
+    Return the precompiled formatter for a `combat_log` entry.
     Usage:
-      get_text("zh", "system_dm") -> returns full prompt
-      get_text("zh", "combat_log", "attack") -> returns specific format string
+      compiled_combat("zh", "attack")(attacker="A", target="B", weapon="C")
     """
-    lang = lang if lang in PROMPTS else "en"
-    cat_data = PROMPTS[lang].get(category)
-    if not cat_data:
-        # Fallback to English if category missing
-        cat_data = PROMPTS["en"].get(category)
-    
-    if key and isinstance(cat_data, dict):
-        return cat_data.get(key, PROMPTS["en"][category].get(key, ""))
-    
-    return cat_data
+    lang = lang if lang in _PROMPT_MODULES else "en"
+    return _compiled_combat_table(lang).get(key) or _compiled_combat_table("en")[key]
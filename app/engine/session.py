@@ -1,27 +1,159 @@
-import json
-import uuid
+import atexit
+import functools
+import logging
+import os
+import secrets
+import threading
+import time
+import orjson
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from app.config import DATA_DIR, STORIES_DIR
+from typing import Dict, List, Optional, Tuple
+from app.config import DATA_DIR, SESSION_SAVE_DEBOUNCE_SECONDS, STORIES_DIR
+from app.engine import character_store
 # 引入 schemas
-from app.schemas import GameSession, PlayerState, SessionCreateRequest
+from app.schemas import CharacterSheet, GameSession, PlayerState, SessionCreateRequest
+
+logger = logging.getLogger(__name__)
 
 SESSIONS_DIR = DATA_DIR / "sessions"
 SESSIONS_DIR.mkdir(parents=True, exist_ok=True)
 
+_fromtimestamp = datetime.fromtimestamp
+
+def _now_iso() -> str:
+    """当前时间（精确到秒），用于 created_at / updated_at"""
+    return _fromtimestamp(time.time()).isoformat(timespec="seconds")
+
+def _read_json(path: Path) -> dict:
+    """一次性读入整个文件并用 orjson 解析"""
+    return orjson.loads(path.read_bytes())
+
+@functools.lru_cache(maxsize=64)
+def _load_story_cached(story_id: str, mtime_ns: int) -> dict:
+    return _read_json(STORIES_DIR / story_id / "story.json")
+
+def _load_story(story_id: str) -> dict:
+    """
+    读取剧本 JSON。剧本文件基本是静态的，按 (story_id, mtime) 缓存解析结果，
+    文件被修改（上传图片/角色等）后 mtime 变化，自动重新读取。
+    返回的 dict 是共享缓存，只读使用。
+    """
+    story_path = STORIES_DIR / story_id / "story.json"
+    if not story_path.exists():
+        raise FileNotFoundError(f"Story {story_id} not found")
+    return _load_story_cached(story_id, story_path.stat().st_mtime_ns)
+
+def _migrate_embedded_sheets(data: dict) -> bool:
+    """
+    旧存档的 players[i] 里内嵌完整 character_sheet：存进 character_store 换成 character_sheet_id。
+    原地修改 data，返回是否做了迁移；迁移后的会话下次保存时就只剩 id。
+    """
+    migrated = False
+    for player in data.get("players") or ():
+        if isinstance(player, dict) and "character_sheet" in player:
+            sheet = player.pop("character_sheet")
+            if not player.get("character_sheet_id"):
+                player["character_sheet_id"] = character_store.save_sheet(CharacterSheet.model_validate(sheet))
+            migrated = True
+    return migrated
+
+def _working_copy(session: GameSession) -> GameSession:
+    """
+    给调用方一份可修改的副本，但不对整个会话 deepcopy（比重新校验还慢）：
+    只复制引擎会原地修改的部分——
+    - 玩家状态整体深拷贝（inventory / conditions 列表会被原地 append/remove）
+    - 敌人状态复制到每个敌人的 dict
+    - 聊天记录复制列表；消息 dict 只追加、不原地修改，共享即可
+    角色卡本身在 character_store 里，只按 id 引用。
+    """
+    return session.model_copy(update={
+        "players": [p.model_copy(deep=True) for p in session.players],
+        "enemy_states": {
+            name: dict(state) if isinstance(state, dict) else state
+            for name, state in session.enemy_states.items()
+        },
+        "chat_history": list(session.chat_history),
+    })
+
+# 聊天记录上限：超出部分折叠进 chat_summary，存档大小和序列化耗时不再随回合数增长。
+# chat_summary 目前只随存档保存（供查看/以后做长期记忆），不进 prompt：
+# 叙事 agent 只读最近 6 条消息（agents/narrative.py），远在裁剪窗口之内
+MAX_HISTORY = 200
+# 摘要只保留最近的这么多字符，每条被折叠的消息截断到 SUMMARY_LINE_CHARS
+SUMMARY_MAX_CHARS = 4000
+SUMMARY_LINE_CHARS = 160
+
+def _trim_history(session: GameSession) -> List[Dict[str, str]]:
+    """
+    把超出 MAX_HISTORY 的旧消息卷进 session.chat_summary（每条一行、截断），
+    不调用 LLM，保存路径上保持廉价。
+    返回被裁掉的原始消息，由后台写盘时追加进归档（见 _archive_path）。
+    """
+    overflow = len(session.chat_history) - MAX_HISTORY
+    if overflow <= 0:
+        return []
+    old = session.chat_history[:overflow]
+    # assistant/tool 消息的 content 可能是 None
+    lines = [f"{m.get('role', '')}: {(m.get('content') or '')[:SUMMARY_LINE_CHARS]}" for m in old]
+    summary = "\n".join(filter(None, [session.chat_summary, *lines]))
+    session.chat_summary = summary[-SUMMARY_MAX_CHARS:]
+    session.chat_history = session.chat_history[overflow:]
+    return old
+
+def _archive_path(session_id: str) -> Path:
+    """
+    被裁掉的完整聊天记录：每行一条消息的 append-only JSONL。
+    只追加新裁掉的几条，不会像存档那样整份重写。
+    """
+    return SESSIONS_DIR / f"{session_id}.history.jsonl"
+
+def _append_archive(session_id: str, messages: List[Dict[str, str]]):
+    with open(_archive_path(session_id), "ab") as f:
+        f.write(b"".join(orjson.dumps(m) + b"\n" for m in messages))
+
+# 会话列表索引：{session_id: {"title": ..., "updated_at": ...}}
+# 列表页只读这一个小文件，不再逐个解析完整的存档
+INDEX_FILENAME = "_index.json"
+
+# 进程内最多缓存这么多个已校验的会话（LRU），长时间运行时内存不随历史会话数增长
+MAX_CACHED_SESSIONS = 128
+
+_SAVE_EXCLUDE = {"players": {"__all__": {"character_sheet"}}}
+
+# 写盘防抖窗口：窗口内对同一 session 的多次保存只落盘最后一次（0 = 同步写盘）
+SAVE_DEBOUNCE_SECONDS = SESSION_SAVE_DEBOUNCE_SECONDS
+
 class SessionManager:
+    """
+    会话存取。缓存（_cache）和待写队列（_dirty）都只在当前进程内：
+    只支持单个 worker 进程（见 app/config.py）。防抖窗口内进程被强杀会丢掉窗口内的改动，
+    正常退出时 atexit 会把剩余的改动写完。
+    """
     def __init__(self):
-        pass
+        # session_id -> 尚未落盘的 GameSession
+        self._dirty: Dict[str, GameSession] = {}
+        # session_id -> 等待追加进归档的旧消息（和 _dirty 一起在 flush 时落盘）
+        self._archive: Dict[str, List[Dict[str, str]]] = {}
+        self._lock = threading.Lock()
+        # 保证多次 flush 之间按顺序写盘，新版本不会被旧版本覆盖
+        self._write_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        # session_id -> (文件 mtime, 已校验的 GameSession)，存档没变就不用重新解析/校验
+        # 按最近使用排序，超过 MAX_CACHED_SESSIONS 时淘汰最久没用的（受 _lock 保护）
+        self._cache: "OrderedDict[str, Tuple[int, GameSession]]" = OrderedDict()
+        # 会话索引的内存副本，首次使用时加载（受 _write_lock 保护）
+        self._index: Optional[Dict[str, dict]] = None
+        # 进程退出前把剩余的脏数据写完
+        atexit.register(self.flush)
+        if int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1:
+            logger.warning("SessionManager keeps sessions in process memory; run a single worker (WEB_CONCURRENCY=1)")
 
     def create_session(self, request: SessionCreateRequest) -> GameSession:
         """初始化一个新的游戏会话"""
-        # 1. 读取原始剧本
-        story_path = STORIES_DIR / request.story_id / "story.json"
-        if not story_path.exists():
-            raise FileNotFoundError(f"Story {request.story_id} not found")
-        
-        with open(story_path, "r", encoding="utf-8") as f:
-            story_data = json.load(f)
+        # 1. 读取原始剧本（带缓存）
+        story_data = _load_story(request.story_id)
 
         # 2. 提取角色
         if request.character_idx >= len(story_data.get("characters", [])):
@@ -29,21 +161,22 @@ class SessionManager:
         
         raw_char = story_data["characters"][request.character_idx]
         
-        # 初始化动态状态
+        # 初始化动态状态：角色卡存进 character_store，玩家状态里只记 id
+        sheet_id = character_store.save_sheet(CharacterSheet.model_validate(raw_char))
         player_state = PlayerState(
             name=request.player_name, 
-            character_sheet=raw_char,
+            character_sheet_id=sheet_id,
             current_hp=raw_char.get("hp_max", 10),
-            inventory=raw_char.get("equipment", [])
+            inventory=raw_char.get("equipment", [])  # PlayerState 校验时会 intern
         )
 
         # 3. 寻找起始节点
         nodes = story_data.get("nodes", {})
-        start_node_id = list(nodes.keys())[0] if nodes else "start"
+        start_node_id = next(iter(nodes), "start")
         
         # 4. 创建 Session
-        session_id = uuid.uuid4().hex[:8]
-        now = datetime.now().isoformat()
+        session_id = secrets.token_hex(4)
+        now = _now_iso()
         
         session = GameSession(
             session_id=session_id,
@@ -59,48 +192,198 @@ class SessionManager:
         )
 
         # 5. 保存
-        print(f">>> DEBUG: Creating session object: {type(session)}") # 调试信息
+        logger.debug("Creating session object: %s", type(session)) # 调试信息
         self.save_session(session)
         
         return session
 
     def load_session(self, session_id: str) -> GameSession:
+        with self._lock:
+            pending = self._dirty.get(session_id)
+            cached = self._cache.get(session_id)
+        if pending is not None:
+            # 还没落盘：直接返回内存里的最新版本（拷贝一份，避免写盘线程读到半修改状态）
+            return _working_copy(pending)
+
         path = SESSIONS_DIR / f"{session_id}.json"
-        if not path.exists():
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
             raise FileNotFoundError("Session not found")
-        
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return GameSession(**data)
+
+        if cached is not None and cached[0] == mtime:
+            with self._lock:
+                if session_id in self._cache:
+                    self._cache.move_to_end(session_id)
+            return _working_copy(cached[1])
+
+        # GameSession 同时是 FastAPI 的 response_model，保持 Pydantic 模型；
+        # orjson 解析 + pydantic-core 校验，比 model_validate_json 单趟解析还快。
+        # 逐层 model_construct 跳过校验反而更慢（约 70us vs 35-48us）：
+        # 它在 Python 层遍历字段、拷贝默认值，而校验整个在 Rust 里完成。
+        # 况且这里只在缓存未命中时才会走到。
+        data = _read_json(path)
+        if _migrate_embedded_sheets(data):
+            logger.info("Session %s: moved embedded character sheets to character_store", session_id)
+        session = GameSession(**data)
+        with self._lock:
+            # 读盘期间有新的保存进来时，不拿旧文件覆盖缓存
+            if session_id not in self._dirty:
+                self._remember(session_id, mtime, session)
+        return _working_copy(session)
+
+    def _remember(self, session_id: str, mtime: int, session: GameSession):
+        """写入 LRU 缓存（调用方持有 _lock）"""
+        self._cache[session_id] = (mtime, session)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > MAX_CACHED_SESSIONS:
+            self._cache.popitem(last=False)
 
     def save_session(self, session: GameSession):
         """
-        将 Session 对象保存为 JSON 文件
+        标记 Session 需要保存，实际写盘在后台线程里防抖完成，
+        请求路径上不再包含序列化和磁盘 I/O（SAVE_DEBOUNCE_SECONDS 为 0 时立即同步写盘）。
+        调用方在 save 之后不应继续修改同一个对象。
         """
-        print(f">>> DEBUG: Saving session using Pydantic serialization...") # 调试信息
-        
+        logger.debug("Saving session %s using Pydantic serialization...", session.session_id) # 调试信息
+
+        session.updated_at = _now_iso()
+        trimmed = _trim_history(session)
+        with self._lock:
+            self._dirty[session.session_id] = session
+            if trimmed:
+                self._archive.setdefault(session.session_id, []).extend(trimmed)
+            if SAVE_DEBOUNCE_SECONDS <= 0:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(SAVE_DEBOUNCE_SECONDS, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """
+        把所有待保存的 Session 立即写盘。
+        每个 session 写完文件、更新缓存之后才从 _dirty 里移除（同一把 _lock 下），
+        写盘期间 load_session 始终能读到最新版本，不会拿到旧缓存再覆盖掉新数据。
+        """
+        with self._write_lock:
+            with self._lock:
+                pending = dict(self._dirty)
+                archive = self._archive
+                self._archive = {}
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+            # 先写归档再写存档：中途崩溃最多在归档里重复几条，不会丢消息
+            for session_id, messages in archive.items():
+                _append_archive(session_id, messages)
+            if not pending:
+                return
+            index = self._load_index()
+            for session in pending.values():
+                mtime = self._write_sync(session)
+                with self._lock:
+                    self._remember(session.session_id, mtime, session)
+                    # 写盘期间又保存了新对象：留在 _dirty 里等下一次 flush
+                    if self._dirty.get(session.session_id) is session:
+                        del self._dirty[session.session_id]
+                index[session.session_id] = {
+                    "title": session.title,
+                    "updated_at": session.updated_at,
+                }
+            self._write_index(index)
+
+    def _write_sync(self, session: GameSession) -> int:
+        """将 Session 对象保存为 JSON 文件，返回写入后文件的 mtime"""
         path = SESSIONS_DIR / f"{session.session_id}.json"
-        session.updated_at = datetime.now().isoformat()
-        
-        with open(path, "w", encoding="utf-8") as f:
-            # --- 绝对不要用 json.dump(session.dict()) ---
-            # 使用 Pydantic 自带的 model_dump_json() 
-            # 它能自动处理嵌套对象序列化
-            f.write(session.model_dump_json(indent=2))
+        # --- 绝对不要用 json.dump(session.dict()) ---
+        # character_sheet 是从 character_store 取出的 computed field，存档里只留 character_sheet_id
+        # 先用 Pydantic 的 model_dump(mode="json") 处理嵌套对象，
+        # 再交给 orjson 编码，直接写入 bytes
+        path.write_bytes(
+            orjson.dumps(
+                session.model_dump(mode="json", exclude=_SAVE_EXCLUDE),
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS,
+            )
+        )
+        return path.stat().st_mtime_ns
 
-    def list_sessions(self):
-        sessions = []
+    def _load_index(self) -> Dict[str, dict]:
+        if self._index is None:
+            index_path = SESSIONS_DIR / INDEX_FILENAME
+            if index_path.exists():
+                try:
+                    self._index = _read_json(index_path)
+                except Exception:
+                    self._index = None
+            if self._index is None:
+                # 索引缺失或损坏：扫描一遍存档重建
+                self._index = self._rebuild_index()
+                self._write_index(self._index)
+        return self._index
+
+    def _rebuild_index(self) -> Dict[str, dict]:
+        index = {}
         for f in SESSIONS_DIR.glob("*.json"):
-            try:
-                with open(f, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-                    sessions.append({
-                        "id": data.get("session_id", f.stem),
-                        "title": data.get("title", "Untitled"),
-                        "updated": data.get("updated_at", "")
-                    })
-            except:
+            if f.name == INDEX_FILENAME:
                 continue
+            entry = self._index_entry(f)
+            if entry is not None:
+                index[f.stem] = entry
+        return index
+
+    @staticmethod
+    def _index_entry(path: Path) -> Optional[dict]:
+        try:
+            data = _read_json(path)
+        except Exception:
+            return None
+        return {
+            "title": data.get("title", "Untitled"),
+            "updated_at": data.get("updated_at", ""),
+        }
+
+    def _reconcile_index(self, index: Dict[str, dict]) -> bool:
+        """
+        用目录列表校正索引（调用方持有 _write_lock）：不经过 save_session 增删的存档
+        （手动清理、别的进程写入）也能反映到列表里。只列目录，只解析新出现的文件。
+        返回索引是否有变化。
+        """
+        on_disk = {f.stem for f in SESSIONS_DIR.glob("*.json") if f.name != INDEX_FILENAME}
+        changed = False
+        for sid in index.keys() - on_disk:
+            del index[sid]
+            changed = True
+        for sid in on_disk - index.keys():
+            entry = self._index_entry(SESSIONS_DIR / f"{sid}.json")
+            if entry is not None:
+                index[sid] = entry
+                changed = True
+        return changed
+
+    def _write_index(self, index: Dict[str, dict]):
+        (SESSIONS_DIR / INDEX_FILENAME).write_bytes(
+            orjson.dumps(index, option=orjson.OPT_INDENT_2)
+        )
+
+    def list_sessions(self):
+        self.flush()
+        with self._write_lock:
+            index = self._load_index()
+            if self._reconcile_index(index):
+                self._write_index(index)
+            sessions = [
+                {
+                    "id": sid,
+                    "title": meta.get("title", "Untitled"),
+                    "updated": meta.get("updated_at", ""),
+                }
+                for sid, meta in index.items()
+            ]
         return sorted(sessions, key=lambda x: x["updated"], reverse=True)
 
 session_manager = SessionManager()
\ No newline at end of file
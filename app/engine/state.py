@@ -1,51 +1,70 @@
-from typing import TypedDict, Annotated, List, Optional, Any
+import functools
+from dataclasses import dataclass, field
+from typing import Annotated, List, Optional, Any
 from langgraph.graph.message import add_messages
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, SystemMessage
 
-class NarrativeAgentState(TypedDict):
+# LangGraph 支持 dataclass 作为 State：slots 实例比 dict 更省内存，
+# 节点里用属性访问（state.session_id）代替字符串 key 查找。
+# 所有字段都带默认值，invoke 时只需传入 Inputs。
+
+@dataclass(slots=True)
+class NarrativeAgentState:
     """LangGraph State for Narrative DM"""
-    messages: Annotated[List[BaseMessage], add_messages]
-    
+    messages: Annotated[List[BaseMessage], add_messages] = field(default_factory=list)
+
     # Inputs
-    session_id: str
-    player_input: str
-    
+    session_id: str = ""
+    player_input: str = ""
+
     # Context (Loaded from DB/Files)
-    system_prompt: str
-    player_name: str
-    player_hp: int
-    current_node: dict
-    story_context_text: str
-    
+    system_prompt: str = ""
+    player_name: str = ""
+    player_hp: int = 0
+    current_node: dict = field(default_factory=dict)
+    story_context_text: str = ""
+
     # Internal Processing
-    mechanics_logs: List[str]
-    
+    mechanics_logs: List[str] = field(default_factory=list)
+
     # Final Outputs
-    final_narrative: str
-    transition_to_id: Optional[str]
-    active_mode: Optional[str]
+    final_narrative: str = ""
+    transition_to_id: Optional[str] = None
+    active_mode: Optional[str] = None
 
-class CombatAgentState(TypedDict):
+@dataclass(slots=True)
+class CombatAgentState:
     """LangGraph State for Fight Agent"""
-    messages: Annotated[List[BaseMessage], add_messages]
-    
+    messages: Annotated[List[BaseMessage], add_messages] = field(default_factory=list)
+
     # Inputs
-    session_id: str
-    player_input: str
-    language: str
-    
+    session_id: str = ""
+    player_input: str = ""
+    language: str = "en"
+
     # Context
-    player_data: dict
-    enemy_data: dict
-    last_dm_narration: str
-    
+    player_data: dict = field(default_factory=dict)
+    enemy_data: dict = field(default_factory=dict)
+    last_dm_narration: Optional[str] = None
+
     # Planner Output
-    combat_plan: dict
-    
+    combat_plan: dict = field(default_factory=dict)
+
     # Simulation Output
-    round_summary: dict
-    
+    round_summary: dict = field(default_factory=dict)
+
     # Final Output
-    final_narrative: str
-    mechanics_log: str
-    active_mode: str
+    final_narrative: str = ""
+    mechanics_log: str = ""
+    active_mode: str = ""
+
+
+@functools.lru_cache(maxsize=128)
+def cached_system_message(content: str) -> SystemMessage:
+    """
+    System prompt 基本是静态文本（system_dm / fight_narrator_system / planner），
+    按内容缓存构造好的 SystemMessage，避免每轮重新构造和校验。
+    str 的 hash 会缓存在对象上，长 prompt 作为 key 也只算一次。
+    返回的是共享对象：只放进发给 LLM 的消息列表，不要写回 State 或修改它。
+    """
+    return SystemMessage(content=content)
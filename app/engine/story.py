@@ -1,28 +1,74 @@
 # app/engine/story.py
 from __future__ import annotations
 
+import functools
 import json
-from dataclasses import dataclass, field, asdict
-from typing import Dict, List, Optional, Any
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Any
+
+import orjson
 
 # ✅ 引入 Pydantic 的 StoryNode schema
 # 路径不同时，把这一行改成实际路径即可
-from app.schemas import StoryNode
+from pydantic import TypeAdapter
+from app.schemas import StoryNode, Entity, Interaction, Loot, Edge as EdgeModel
+
+# 场景图的唯一定义：其它模块统一从这里导入
+__all__ = [
+    "EnvironmentSpec",
+    "EntitySpec",
+    "InteractionSpec",
+    "LootSpec",
+    "Edge",
+    "SceneNode",
+    "StoryGraph",
+]
+
+
+def _intern(value: Any) -> Any:
+    """
+    type / state / disposition / light 这类字段在整个剧本里只有十来种取值，
+    intern 之后所有场景共享同一个字符串对象，比较也退化成指针比较。
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+def _as_int(value: Any) -> int:
+    # JSON 里几乎总是已经是 int，只在不是时才转换
+    return value if type(value) is int else int(value)
+
+
+def _as_float(value: Any) -> float:
+    return value if type(value) is float else float(value)
 
 
 # ---------------------------------------------------------------------------
 # Core data structures
+# 全部用 slots：大剧本里 Entity/Edge 实例成千上万，省掉每个实例的 __dict__
 # ---------------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True)
 class EnvironmentSpec:
     light: str = "Bright light"
     terrain: str = "Normal"
     sound: str = "Quiet"
     notes: Optional[str] = None
 
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> EnvironmentSpec:
+        return cls(
+            light=_intern(d.get("light", "Normal")),
+            terrain=_intern(d.get("terrain", "Normal")),
+            sound=_intern(d.get("sound", "")),
+            notes=d.get("notes"),
+        )
 
-@dataclass
+    def _to_plain(self) -> Dict[str, Any]:
+        return {"light": self.light, "terrain": self.terrain, "sound": self.sound, "notes": self.notes}
+
+
+@dataclass(slots=True)
 class EntitySpec:
     name: str
     type: str = "monster"
@@ -30,33 +76,117 @@ class EntitySpec:
     count: int = 1
     state: str = "Idle"
     disposition: str = "hostile"
-    extra: Dict[str, Any] = field(default_factory=dict)
+    # 绝大多数实体没有 extra：默认 None，不为每个实例分配空 dict
+    extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> EntitySpec:
+        return cls(
+            name=d["name"],
+            type=_intern(d.get("type", "monster")),
+            ref_slug=d.get("ref_slug"),
+            count=_as_int(d.get("count", 1)),
+            state=_intern(d.get("state", "Idle")),
+            disposition=_intern(d.get("disposition", "hostile")),
+            extra=d.get("extra") or None,
+        )
 
+    @classmethod
+    def from_model(cls, m: Entity) -> EntitySpec:
+        # 已校验的 schema 对象：属性访问，不再做 dict 查找和类型转换
+        return cls(
+            name=m.name,
+            type=_intern(m.type),
+            ref_slug=m.ref_slug,
+            count=m.count,
+            state=_intern(m.state),
+            disposition=_intern(m.disposition),
+            extra=m.extra or None,
+        )
 
-@dataclass
+    def _to_plain(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "type": self.type,
+            "ref_slug": self.ref_slug,
+            "count": self.count,
+            "state": self.state,
+            "disposition": self.disposition,
+            "extra": dict(self.extra) if self.extra else {},
+        }
+
+
+@dataclass(slots=True)
 class InteractionSpec:
     trigger: str
     mechanic: str
     success: str
     failure: Optional[str] = None
 
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> InteractionSpec:
+        return cls(
+            trigger=d["trigger"],
+            mechanic=d.get("mechanic", "None"),
+            success=d.get("success", ""),
+            failure=d.get("failure"),
+        )
 
-@dataclass
+    @classmethod
+    def from_model(cls, m: Interaction) -> InteractionSpec:
+        return cls(trigger=m.trigger, mechanic=m.mechanic, success=m.success, failure=m.failure)
+
+    def _to_plain(self) -> Dict[str, Any]:
+        return {"trigger": self.trigger, "mechanic": self.mechanic, "success": self.success, "failure": self.failure}
+
+
+@dataclass(slots=True)
 class LootSpec:
     item: str
     quantity: int = 1
     description: Optional[str] = None
 
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> LootSpec:
+        return cls(
+            item=d["item"],
+            quantity=_as_int(d.get("quantity", 1)),
+            description=d.get("description"),
+        )
+
+    @classmethod
+    def from_model(cls, m: Loot) -> LootSpec:
+        return cls(item=m.item, quantity=m.quantity, description=m.description)
+
+    def _to_plain(self) -> Dict[str, Any]:
+        return {"item": self.item, "quantity": self.quantity, "description": self.description}
+
 
-@dataclass
+@dataclass(slots=True)
 class Edge:
     to: str
     weight: float = 1.0
     label: str = ""
     condition: Optional[str] = None
 
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> Edge:
+        return cls(
+            to=d["to"],
+            weight=_as_float(d.get("weight", 1.0)),
+            label=d.get("label", ""),
+            condition=d.get("condition"),
+        )
+
+    @classmethod
+    def from_model(cls, m: EdgeModel) -> Edge:
+        return cls(to=m.to, weight=m.weight, label=m.label, condition=m.condition)
+
+    def _to_plain(self) -> Dict[str, Any]:
+        return {"to": self.to, "weight": self.weight, "label": self.label, "condition": self.condition}
+
 
-@dataclass
+@dataclass(slots=True)
 class SceneNode:
     """
     A single game state/location in the adventure.
@@ -73,9 +203,11 @@ class SceneNode:
     gm_guidance: str = ""
 
     environment: EnvironmentSpec = field(default_factory=EnvironmentSpec)
-    entities: List[EntitySpec] = field(default_factory=list)
-    interactions: List[InteractionSpec] = field(default_factory=list)
-    loot: List[LootSpec] = field(default_factory=list)
+    # 这三项经常为空：默认 None 而不是每个场景各分配一个空列表，
+    # 读取时用 `node.entities or ()`，导出时统一成 []
+    entities: Optional[List[EntitySpec]] = None
+    interactions: Optional[List[InteractionSpec]] = None
+    loot: Optional[List[LootSpec]] = None
 
     # ✅ 新增：把 options 也保存下来，方便前端展示按钮
     # schema 那边可以是 List[Any] 或 List[Union[str, Dict[str, Any]]]
@@ -86,13 +218,134 @@ class SceneNode:
     # 为了兼容之前的功能，建议加一个 image_path 字段
     image_path: Optional[str] = None
 
+    def _to_plain(self) -> Dict[str, Any]:
+        """直接读属性导出为 dict，比 dataclasses.asdict 的递归 deepcopy 便宜得多"""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "type": self.type,
+            "min_turns": self.min_turns,
+            "read_aloud": self.read_aloud,
+            "gm_guidance": self.gm_guidance,
+            "environment": self.environment._to_plain(),
+            "entities": [e._to_plain() for e in self.entities or ()],
+            "interactions": [i._to_plain() for i in self.interactions or ()],
+            "loot": [l._to_plain() for l in self.loot or ()],
+            "options": list(self.options),
+            "edges": [e._to_plain() for e in self.edges],
+            "image_path": self.image_path,
+        }
+
+
+def _build_scene(
+    story_node: StoryNode,
+    _Scene=SceneNode,
+    _env=EnvironmentSpec.from_dict,
+    _entity=EntitySpec.from_model,
+    _interaction=InteractionSpec.from_model,
+    _loot=LootSpec.from_model,
+    _edge=Edge.from_model,
+) -> SceneNode:
+    """
+    StoryNode（已校验）-> SceneNode。
+    构造函数通过默认参数绑定成局部变量，批量加载时循环里不再查全局名/属性。
+    """
+    return _Scene(
+        id=story_node.id,
+        title=story_node.title or story_node.id,
+        type=_intern(story_node.type or "encounter"),
+        min_turns=story_node.min_turns or 1,  # StoryNode 已校验为 int
+        read_aloud=story_node.read_aloud or "",
+        gm_guidance=story_node.gm_guidance or "",
+        # 子结构：每个 dataclass 自带 from_dict，字段默认值集中在类定义旁边
+        environment=_env(story_node.environment or {}),
+        entities=[_entity(e) for e in story_node.entities] or None,
+        interactions=[_interaction(i) for i in story_node.interactions] or None,
+        loot=[_loot(l) for l in story_node.loot] or None,
+        # Options：直接挂在 SceneNode 上，供前端展示按钮，保持灵活性
+        options=story_node.options or [],
+        # Edges ✅ 这里用 story_node.edges（JSON 字段叫 edges，不是 next）
+        edges=[_edge(ed) for ed in story_node.edges],
+        image_path=story_node.image_path,  # 仍然支持从 JSON 加载图片路径
+    )
+
+
+# 批量校验场景列表用的 adapter（构建一次，复用其编译好的校验器）
+_STORY_NODE_LIST = TypeAdapter(List[StoryNode])
+
+# Mermaid 节点形状：按场景类型查表，默认方框
+_SHAPES: Dict[str, Tuple[str, str]] = {
+    "combat": ("([", "])"),
+    "transition": ("{{", "}}"),
+}
+_DEFAULT_SHAPE = ("[", "]")
+
+
+@functools.lru_cache(maxsize=1024)
+def _mermaid_edge_label(label: str) -> str:
+    """边标签 -> Mermaid 片段（'|"..."|' 或空串），截断/转义按标签缓存"""
+    if not label:
+        return ""
+    label = label.replace('"', "'")
+    if len(label) > 20:
+        label = label[:20] + "..."
+    return f'|"{label}"|'
+
 
 class StoryGraph:
     def __init__(self) -> None:
         self.nodes: Dict[str, SceneNode] = {}
+        # 整数下标索引（按需构建）：_ids[i] 是第 i 个场景的 id，
+        # _adj[i] 是它指向的场景下标，_dangling 记录指向不存在场景的边 (src_idx, to)。
+        # 图检查只在整数数组上跑，不再对每条边做字符串 hash 查找。
+        self._ids: Optional[List[str]] = None
+        self._id_to_idx: Dict[str, int] = {}
+        self._adj: List[List[int]] = []
+        self._dangling: List[Tuple[int, str]] = []
+        # to_json 的结果缓存 (indent, text)；图没变时重复导出直接返回
+        self._json_cache: Optional[Tuple[int, str]] = None
 
     def add_scene(self, node: SceneNode) -> None:
         self.nodes[node.id] = node
+        self._ids = None
+        self._json_cache = None
+
+    def add_edge(self, from_id: str, to: str, weight: float = 1.0, label: str = "", condition: Optional[str] = None) -> Edge:
+        """给已有场景加一条出边；索引已构建时增量更新，不整体重建"""
+        edge = Edge(to=to, weight=weight, label=label, condition=condition)
+        self.nodes[from_id].edges.append(edge)
+        self._json_cache = None
+        if self._ids is not None:
+            src = self._id_to_idx[from_id]
+            dst = self._id_to_idx.get(to)
+            if dst is None:
+                self._dangling.append((src, to))
+            else:
+                self._adj[src].append(dst)
+        return edge
+
+    def _ensure_index(self) -> None:
+        """
+        构建 id <-> 下标 和邻接表。add_scene 会让索引失效；
+        直接改 node.edges 不会被感知，加边请走 add_edge。
+        """
+        if self._ids is not None:
+            return
+        ids = list(self.nodes)
+        id_to_idx = {sid: i for i, sid in enumerate(ids)}
+        adj: List[List[int]] = []
+        dangling: List[Tuple[int, str]] = []
+        for i, sid in enumerate(ids):
+            row = []
+            for edge in self.nodes[sid].edges:
+                j = id_to_idx.get(edge.to)
+                if j is None:
+                    dangling.append((i, edge.to))
+                else:
+                    row.append(j)
+            adj.append(row)
+        self._id_to_idx, self._adj, self._dangling = id_to_idx, adj, dangling
+        self._ids = ids
 
     # -----------------------------------------------------------------------
     # ✅ 核心改动：先用 StoryNode schema 做解析 + 校验
@@ -103,101 +356,61 @@ class StoryGraph:
         先用 Pydantic 的 StoryNode 进行校验和默认值填充，
         然后再转换为内部的 SceneNode。
         """
-        # 1. 用 StoryNode 做一次标准化和类型校验
-        story_node = StoryNode(**data)
-
-        # 2. Environment
-        env_data = story_node.environment or {}
-        environment = EnvironmentSpec(
-            light=env_data.get("light", "Normal"),
-            terrain=env_data.get("terrain", "Normal"),
-            sound=env_data.get("sound", ""),
-            notes=env_data.get("notes"),
-        )
-
-        # 3. Entities
-        entities: List[EntitySpec] = []
-        for e in story_node.entities or []:
-            entities.append(
-                EntitySpec(
-                    name=e["name"],
-                    type=e.get("type", "monster"),
-                    ref_slug=e.get("ref_slug"),
-                    count=int(e.get("count", 1)),
-                    state=e.get("state", "Idle"),
-                    disposition=e.get("disposition", "hostile"),
-                    extra=e.get("extra", {}),
-                )
-            )
-
-        # 4. Interactions
-        interactions: List[InteractionSpec] = []
-        for i in story_node.interactions or []:
-            interactions.append(
-                InteractionSpec(
-                    trigger=i["trigger"],
-                    mechanic=i.get("mechanic", "None"),
-                    success=i.get("success", ""),
-                    failure=i.get("failure"),
-                )
-            )
-
-        # 5. Loot（schema 里没有的话就从原始 data 兜底）
-        loot: List[LootSpec] = []
-        for l in data.get("loot", []):
-            loot.append(
-                LootSpec(
-                    item=l["item"],
-                    quantity=int(l.get("quantity", 1)),
-                    description=l.get("description"),
-                )
-            )
-
-        # 6. Edges ✅ 这里改为 story_node.edges（JSON 字段叫 edges，不是 next）
-        edges: List[Edge] = []
-        for ed in story_node.edges or []:
-            edges.append(
-                Edge(
-                    to=ed["to"],
-                    weight=float(ed.get("weight", 1.0)),
-                    label=ed.get("label", ""),
-                    condition=ed.get("condition"),
-                )
-            )
-
-        # 7. Options：直接挂在 SceneNode 上，供前端使用
-        #   - 如果 LLM 生成的是简单字符串数组，也可以先做一层清洗
-        raw_options = story_node.options or []
-        # 这里直接塞进 SceneNode，保持灵活性
-        options: List[Any] = raw_options
-
-        # 8. 构造内部 SceneNode
-        node = SceneNode(
-            id=story_node.id,
-            title=story_node.title or story_node.id,
-            type=story_node.type or "encounter",
-            min_turns=int(story_node.min_turns or 1),
-            read_aloud=story_node.read_aloud or "",
-            gm_guidance=story_node.gm_guidance or "",
-            environment=environment,
-            entities=entities,
-            interactions=interactions,
-            loot=loot,
-            options=options,
-            edges=edges,
-            image_path=data.get("image_path"),  # 仍然支持从 JSON 加载图片路径
-        )
-
-        self.add_scene(node)
-        return node
+        # 用 StoryNode 做唯一一次标准化和类型校验
+        return self.add_scene_from_story_node(StoryNode.model_validate(data))
 
     # 如果你有地方已经拿到了 StoryNode 实例，也可以用这个 helper
     def add_scene_from_story_node(self, story_node: StoryNode) -> SceneNode:
         """
         直接从 StoryNode（Pydantic 实例）构建 SceneNode。
-        和 add_scene_from_dict 内部逻辑保持一致。
+        StoryNode 已经校验过，这里不再 model_dump 再校验一遍。
         """
-        return self.add_scene_from_dict(story_node.model_dump())
+        node = _build_scene(story_node)
+        self.add_scene(node)
+        return node
+
+    # -----------------------------------------------------------------------
+    # 图结构检查
+    # -----------------------------------------------------------------------
+    def validate_graph(self) -> List[str]:
+        """
+        返回图里的问题描述（空列表表示没问题）：
+        目前检查指向不存在场景的边。
+        """
+        if self._ids is None:
+            # 常见情况是没有悬空边：先用一次集合差（C 层完成）判断，
+            # 没问题就直接返回，不必为此构建整张邻接表
+            targets = {e.to for node in self.nodes.values() for e in node.edges}
+            if not targets - self.nodes.keys():
+                return []
+        self._ensure_index()
+        ids = self._ids
+        return [f"Scene '{ids[i]}' has an edge to unknown scene '{to}'" for i, to in self._dangling]
+
+    def check_is_dag(self) -> bool:
+        """
+        检查剧情图是否无环。
+        Kahn 拓扑排序：在整数邻接表上数入度，反复摘掉入度为 0 的场景，
+        摘不完说明有环。纯整数列表操作，比迭代 DFS 少了每层的迭代器/元组，
+        长链剧本也不会撞到递归上限。指向不存在节点的边不参与。
+        """
+        self._ensure_index()
+        adj = self._adj
+        indegree = [0] * len(adj)
+        for row in adj:
+            for child in row:
+                indegree[child] += 1
+
+        ready = [i for i, d in enumerate(indegree) if not d]
+        removed = 0
+        while ready:
+            idx = ready.pop()
+            removed += 1
+            for child in adj[idx]:
+                indegree[child] -= 1
+                if not indegree[child]:
+                    ready.append(child)
+        return removed == len(adj)
 
     # -----------------------------------------------------------------------
     # 批量加载 / 导出
@@ -209,20 +422,38 @@ class StoryGraph:
         - 要么是对象数组 [ {...}, {...}, ... ]
         """
         try:
-            data = json.loads(json_str)
-        except json.JSONDecodeError as e:
+            # orjson 只吃 bytes/str，解析比标准库快数倍
+            data = orjson.loads(json_str)
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON string: {e}")
 
+        return self.add_scenes_from_parsed(data)
+
+    def add_scenes_from_parsed(self, data: Any) -> List[SceneNode]:
+        """
+        输入是已经解析好的 JSON（单个场景 dict 或场景 list），
+        调用方手里已有 Python 对象时用它，避免 dumps 再 loads 一遍。
+        """
         if isinstance(data, dict):
             data = [data]
 
         if not isinstance(data, list):
             raise ValueError("Input JSON must be a list of scene objects.")
 
-        created_nodes: List[SceneNode] = []
-        for scene_data in data:
-            node = self.add_scene_from_dict(scene_data)
-            created_nodes.append(node)
+        # 先全部校验、构造完再一次性写入：中途有场景不合法时图保持不变。
+        # 整个列表交给 pydantic-core 一次校验，循环在 Rust 里完成
+        return self.add_scenes_from_story_nodes(_STORY_NODE_LIST.validate_python(data))
+
+    def add_scenes_from_story_nodes(self, story_nodes: List[StoryNode]) -> List[SceneNode]:
+        """
+        批量加入已经校验好的 StoryNode（例如调用方自己用 TypeAdapter 校验过的结果），
+        不再经过 dict，一次性写入图。
+        """
+        build = _build_scene
+        created_nodes = [build(story_node) for story_node in story_nodes]
+        self.nodes.update((node.id, node) for node in created_nodes)
+        self._ids = None
+        self._json_cache = None
 
         return created_nodes
 
@@ -232,11 +463,33 @@ class StoryGraph:
         注意这里只输出 nodes，外层的 story id/title/characters
         一般在别的地方（比如数据库模型或 API schema）包一层。
         """
-        out_nodes: Dict[str, Any] = {}
-        for sid, node in self.nodes.items():
-            node_dict = asdict(node)
-            out_nodes[sid] = node_dict
+        out_nodes: Dict[str, Any] = {sid: node._to_plain() for sid, node in self.nodes.items()}
         return {"nodes": out_nodes}
 
+    def to_mermaid(self) -> str:
+        """导出为 Mermaid flowchart 文本，方便在前端/文档里预览剧情走向"""
+        lines: List[str] = ["graph TD"]
+        shapes, edge_label = _SHAPES, _mermaid_edge_label
+        for sid, node in self.nodes.items():
+            so, sc = shapes.get(node.type, _DEFAULT_SHAPE)
+            title = node.title.replace('"', "'")
+            lines.append(f'    {sid}{so}"{title}"{sc}')
+            # 内层循环只剩字符串拼接：标签片段已查表/缓存
+            lines.extend([f"    {sid} -->{edge_label(e.label)} {e.to}" for e in node.edges])
+        return "\n".join(lines)
+
     def to_json(self, indent: int = 2) -> str:
-        return json.dumps(self.to_dict(), ensure_ascii=False, indent=indent)
+        """
+        导出 JSON 文本。结果会缓存到下一次 add_scene / add_edge，
+        直接修改节点对象不会让缓存失效。
+        """
+        cached = self._json_cache
+        if cached is not None and cached[0] == indent:
+            return cached[1]
+        # orjson 只支持 2 空格缩进，其它缩进走标准库
+        if indent == 2:
+            text = orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+        else:
+            text = json.dumps(self.to_dict(), ensure_ascii=False, indent=indent)
+        self._json_cache = (indent, text)
+        return text
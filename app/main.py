@@ -1,11 +1,14 @@
 # app/main.py
+import logging
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from pathlib import Path  # <--- 补上这个！
 
 from app.api.routes import router
-from app.config import DATA_DIR, STORIES_DIR
+from app.config import DATA_DIR, STORIES_DIR, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
 
 app = FastAPI(title="AI Dungeon Master API")
 
@@ -22,6 +25,7 @@ app.mount("/static/data", StaticFiles(directory=DATA_DIR), name="static_data")
 # ============================================================
 # 获取项目根目录下的 static 文件夹
 STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+INDEX_FILE = STATIC_DIR / "index.html"
 
 # 注意：为了避免 "/static/data" 被 "/static" 覆盖拦截，
 # FastAPI 会自动处理最长前缀匹配，所以顺序其实没关系，但逻辑上这样写没问题。
@@ -39,11 +43,10 @@ app.include_router(router)
 # ============================================================
 @app.get("/")
 async def read_root():
-    # 确保 index.html 存在，否则会报错
-    index_file = STATIC_DIR / "index.html"
-    if not index_file.exists():
+    # index.html 是否存在在启动时检查一次，请求路径上不再 stat
+    if not app.state.index_exists:
         return {"error": "static/index.html not found. Please create the file."}
-    return FileResponse(index_file)
+    return FileResponse(INDEX_FILE)
 
 
 # ============================================================
@@ -54,4 +57,5 @@ def startup_event():
     print(f">>> Mounting UI from: {STATIC_DIR}")
     print(f">>> Mounting Data from: {DATA_DIR}")
     STORIES_DIR.mkdir(parents=True, exist_ok=True)
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    app.state.index_exists = INDEX_FILE.exists()
\ No newline at end of file
@@ -1,11 +1,17 @@
 # app/schemas.py
-from pydantic import BaseModel, Field
+import sys
+from pydantic import BaseModel, Field, PrivateAttr, TypeAdapter, computed_field, field_validator, model_validator
 from typing import List, Optional, Dict, Any
 
 # ==========================================
 # 1. CHARACTER SHEET MODELS
 # ==========================================
 
+# 技能、装备、状态这类字段的取值来自一个很小的词表，
+# intern 后所有会话/角色卡共享同一批字符串对象
+def _intern_list(v: List[str]) -> List[str]:
+    return [sys.intern(s) for s in v]
+
 class AbilityScores(BaseModel):
     strength: int
     dexterity: int
@@ -20,6 +26,11 @@ class Attack(BaseModel):
     damage: str = Field(..., description="Damage dice string")
     damage_type: str = Field(..., description="Type of damage")
 
+    @field_validator("damage_type", mode="after")
+    @classmethod
+    def _intern_damage_type(cls, v: str) -> str:
+        return sys.intern(v)
+
 class Spellcasting(BaseModel):
     spell_save_dc: int
     spell_attack_bonus: int
@@ -73,6 +84,11 @@ class CharacterSheet(BaseModel):
     all_files: List[str] = []       
     avatar_path: Optional[str] = None
 
+    @field_validator("skill_proficiencies", "saving_throw_proficiencies", "equipment", "features", mode="after")
+    @classmethod
+    def _intern_lists(cls, v: List[str]) -> List[str]:
+        return _intern_list(v)
+
 # ==========================================
 # 2. MONSTER SHEET MODELS
 # ==========================================
@@ -143,24 +159,75 @@ class GameActionRequest(BaseModel):
     """前端发送给后端的玩家动作"""
     action: str
 
-class DMResponse(BaseModel):
-    """LLM 返回给系统的结构化指令"""
-    narrative: str = Field(..., description="The story description to show the player.")
-    damage_taken: int = Field(0, description="Amount of damage the player takes this turn (0 if none).")
-    transition_to_id: Optional[str] = Field(None, description="The ID of the next node if the scene changes.")
-
 class PlayerState(BaseModel):
     """运行时玩家状态 (动态)"""
     model_config = {"populate_by_name": True}
 
     name: str
-    character_sheet: CharacterSheet # 静态数据的完整拷贝
+    # 角色卡是静态数据，存在 character_store 里，这里只记 id（见 character_sheet 属性）。
+    # 校验不做任何 I/O：新建会话和旧存档迁移由 session 模块先 save_sheet 再传入 id。
+    # API 输出（GET /sessions/{id} 等）仍带完整的 character_sheet，存档里只写 id
+    character_sheet_id: str
     current_hp: int
     temp_hp: int = 0
     conditions: List[str] = []      
     inventory: List[str] = []       
     position: str = "default"       
 
+    @field_validator("conditions", "inventory", mode="after")
+    @classmethod
+    def _intern_lists(cls, v: List[str]) -> List[str]:
+        return _intern_list(v)
+
+    @field_validator("position", mode="after")
+    @classmethod
+    def _intern_position(cls, v: str) -> str:
+        return sys.intern(v)
+
+    @computed_field
+    @property
+    def character_sheet(self) -> CharacterSheet:
+        """从 character_store 取角色卡（解析有缓存，每次返回独立副本）"""
+        from app.engine.character_store import get_sheet
+        return get_sheet(self.character_sheet_id)
+
+
+# StoryNode 的子结构：剧本加载时就校验成有类型的对象，坏数据在这里报出来，
+# 而不是玩到一半才出错。字段默认值与 app.engine.story 里的 dataclass 保持一致
+class Entity(BaseModel):
+    # 上传怪物卡后 routes 会往实体上挂 stats / image_path / source，原样保留
+    model_config = {"extra": "allow"}
+
+    name: str
+    type: str = "monster"
+    ref_slug: Optional[str] = None
+    count: int = 1
+    state: str = "Idle"
+    disposition: str = "hostile"
+    extra: Optional[Dict[str, Any]] = None
+
+class Interaction(BaseModel):
+    trigger: str
+    mechanic: str = "None"
+    success: str = ""
+    failure: Optional[str] = None
+
+class Loot(BaseModel):
+    item: str
+    quantity: int = 1
+    description: Optional[str] = None
+
+class Edge(BaseModel):
+    to: str
+    weight: float = 1.0
+    label: str = ""
+    condition: Optional[str] = None
+
+    @field_validator("label", mode="before")
+    @classmethod
+    def _label_none_to_empty(cls, v):
+        # 旧剧本 / LLM 输出里可能是 null；与 story.Edge.label: str 保持一致
+        return "" if v is None else v
 
 class StoryNode(BaseModel):
     id: str
@@ -170,11 +237,25 @@ class StoryNode(BaseModel):
     gm_guidance: str
     min_turns: int = Field(1, description="Minimum interaction turns required before transition") # <--- 新增这个
     environment: Dict[str, Any]
-    entities: List[Dict[str, Any]]
+    entities: List[Entity]
     options: List[str]
-    interactions: List[Dict[str, Any]]
-    loot: List[Dict[str, Any]] = [] # <--- 新增物品列表
-    edges: List[Dict[str, Any]]
+    interactions: List[Interaction]
+    loot: List[Loot] = [] # <--- 新增物品列表
+    edges: List[Edge]
+    image_path: Optional[str] = None # 场景插图（上传/生成后写回 story.json）
+
+    # options 和 interactions 按 trigger 一一对应：校验时建好索引，选项 -> 交互 O(1) 查找
+    _trigger_index: Dict[str, Interaction] = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode="after")
+    def _build_trigger_index(self) -> "StoryNode":
+        # trigger 已由 Interaction 校验为 str
+        self._trigger_index = {inter.trigger: inter for inter in self.interactions}
+        return self
+
+    def interaction_for(self, trigger: str) -> Optional[Interaction]:
+        """玩家选择某个 option 时，取出对应的 interaction（没有则返回 None）"""
+        return self._trigger_index.get(trigger)
 
 class GameSession(BaseModel):
     """完整的游戏存档结构"""
@@ -197,10 +278,19 @@ class GameSession(BaseModel):
     enemy_states: Dict[str, Any] = {}
     
     chat_history: List[Dict[str, str]] = [] 
+    # 被裁掉的早期聊天记录的简要摘要（见 session.MAX_HISTORY）；只存档，不进 prompt
+    chat_summary: str = ""
     
     created_at: str
     updated_at: str
 
+    def model_post_init(self, __context: Any) -> None:
+        # 聊天记录里的 role 只有寥寥几种取值，intern 后所有消息共享同一个字符串对象
+        for msg in self.chat_history:
+            role = msg.get("role")
+            if role is not None:
+                msg["role"] = sys.intern(role)
+
 class SessionCreateRequest(BaseModel):
     """创建新会话的请求参数"""
     story_id: str
@@ -217,4 +307,8 @@ class DMResponse(BaseModel):
     
     # --- 新增字段 ---
     # 取值: "action" (探索模式) | "fight" (战斗模式) | null (保持当前)
-    active_mode: Optional[str] = Field(None, description="Force frontend to switch tab.")
\ No newline at end of file
+    active_mode: Optional[str] = Field(None, description="Force frontend to switch tab.")
+
+# 回合接口每次都要序列化 DMResponse：adapter 在导入时构建一次，
+# routes 直接拿 dump_json 出来的 bytes 作为响应体
+DM_RESPONSE_ADAPTER = TypeAdapter(DMResponse)
@@ -1,24 +1,106 @@
 # app/services/pdf_service.py
 import os
+import io
+import asyncio
 import base64
-from typing import List
-from openai import OpenAI
-from app.api.deepseek import DeepSeek
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from PIL import ExifTags, Image, ImageOps
+from openai import AsyncOpenAI
+from app.api.deepseek import AsyncDeepSeek
 from app.schemas import CharacterSheet, MonsterSheet
 
-if os.getenv("OPENAI_API_KEY"):
-    MODEL_NAME = "gpt-5.1"
-    client = OpenAI()
-elif os.getenv("DEEPSEEK_API_KEY"):
-    MODEL_NAME = "deepseek-chat" 
-    client = DeepSeek()
-else:
+MODEL_NAME = "gpt-5.1" if os.getenv("OPENAI_API_KEY") else "deepseek-chat"
+
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> AsyncOpenAI:
+    """
+    懒加载的进程级单例：所有请求共用一个异步连接池，等待 Vision 结果时不占用事件循环。
+    第一次上传图片时才创建，缺 key 也只在真正调用时才报错。
+    """
+    if os.getenv("OPENAI_API_KEY"):
+        return AsyncOpenAI()
+    if os.getenv("DEEPSEEK_API_KEY"):
+        return AsyncDeepSeek()
     raise ValueError("No API key found for OpenAI or DeepSeek")
 
-def encode_image(image_bytes: bytes) -> str:
-    return base64.b64encode(image_bytes).decode('utf-8')
+# 图片预处理：小图用 detail="low"（固定少量 token）；
+# 大图先缩到长边 VISION_MAX_SIDE 再以 JPEG 重新编码，上传体积和服务端 tile 数都小很多
+VISION_LOW_DETAIL_SIDE = 512
+VISION_MAX_SIDE = 1568
+VISION_JPEG_QUALITY = 85
+
+# Vision API 接受的格式，不超过 VISION_MAX_SIDE 且不需要转正时原样上传。
+# 其余格式（手机 JPEG 常被 Pillow 识别成 MPO，还有 BMP / TIFF 等）一律重新编码成 JPEG
+_PASSTHROUGH_MIME = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "WEBP": "image/webp"}
+
+def _prepare_image(image_bytes: bytes) -> Tuple[bytes, str, str]:
+    """返回 (要上传的 bytes, MIME 类型, detail)"""
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        long_side = max(img.size)
+        # 手机拍的角色卡常带 EXIF 旋转信息：需要转正的图不能原样上传
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+    except Exception:
+        # Pillow 不认识的格式：原样上传，按旧逻辑处理
+        return image_bytes, "image/jpeg", "high"
+
+    detail = "low" if long_side <= VISION_LOW_DETAIL_SIDE else "high"
+    mime = _PASSTHROUGH_MIME.get(img.format)
+    if mime and long_side <= VISION_MAX_SIDE and orientation == 1:
+        return image_bytes, mime, detail
+
+    img = ImageOps.exif_transpose(img)
+    if long_side > VISION_MAX_SIDE:
+        img.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=VISION_JPEG_QUALITY)
+    return buf.getvalue(), "image/jpeg", detail
+
+# 最近处理过的图片：blake2b(原始内容) -> image_url 内容（data URL + detail）。
+# 重试 / 同一张图重复上传时直接复用，不再重新缩放和编码几 MB 的数据。
+# 原样上传的图可能很大，按 data URL 的总字节数而不是条数限制（LRU 淘汰），
+# 单张超过上限的图不缓存
+_B64_CACHE: "OrderedDict[bytes, Dict[str, str]]" = OrderedDict()
+_B64_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_b64_cache_bytes = 0
+_B64_LOCK = threading.Lock()
+
+def encode_image(image_bytes: bytes) -> Dict[str, str]:
+    """图片 bytes -> 消息里 image_url 字段的内容"""
+    global _b64_cache_bytes
+    key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+    with _B64_LOCK:
+        cached = _B64_CACHE.get(key)
+        if cached is not None:
+            _B64_CACHE.move_to_end(key)
+            return cached
+    data, mime, detail = _prepare_image(image_bytes)
+    encoded = {
+        "url": f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}",
+        "detail": detail,
+    }
+    size = len(encoded["url"])
+    if size > _B64_CACHE_MAX_BYTES:
+        return encoded
+    with _B64_LOCK:
+        old = _B64_CACHE.pop(key, None)
+        if old is not None:
+            _b64_cache_bytes -= len(old["url"])
+        _B64_CACHE[key] = encoded
+        _b64_cache_bytes += size
+        while _b64_cache_bytes > _B64_CACHE_MAX_BYTES:
+            _, evicted = _B64_CACHE.popitem(last=False)
+            _b64_cache_bytes -= len(evicted["url"])
+    return encoded
 
-def parse_character_images(image_bytes_list: List[bytes], user_context: str = "") -> CharacterSheet:
+async def parse_character_images(image_bytes_list: List[bytes], user_context: str = "") -> CharacterSheet:
     """
     支持多图解析：
     接收一个 bytes 列表 -> 构造包含多个 image_url 的 Prompt -> 发送给 GPT-4o
@@ -32,16 +114,11 @@ def parse_character_images(image_bytes_list: List[bytes], user_context: str = ""
         }
     ]
 
-    # 2. 遍历所有图片，转 Base64 并追加到消息里
-    for img_bytes in image_bytes_list:
-        base64_image = encode_image(img_bytes)
-        user_content.append({
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}",
-                "detail": "high"
-            }
-        })
+    # 2. 遍历所有图片，缩放 + 转 Base64 并追加到消息里
+    # 缩放是 CPU 活：放到线程池里多页并行，不阻塞事件循环
+    image_urls = await asyncio.gather(*(asyncio.to_thread(encode_image, b) for b in image_bytes_list))
+    for image_url in image_urls:
+        user_content.append({"type": "image_url", "image_url": image_url})
 
     # 3. 系统提示词
     system_prompt = """
@@ -52,7 +129,7 @@ def parse_character_images(image_bytes_list: List[bytes], user_context: str = ""
 
     # 4. 调用 GPT-4o Vision
     try:
-        completion = client.beta.chat.completions.parse(
+        completion = await get_client().beta.chat.completions.parse(
             model="gpt-4o-2024-08-06", 
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -71,11 +148,11 @@ def parse_character_images(image_bytes_list: List[bytes], user_context: str = ""
         print(f"Vision API Error: {e}")
         raise e
     
-def parse_monster_image(image_bytes: bytes, user_context: str = "") -> MonsterSheet:
+async def parse_monster_image(image_bytes: bytes, user_context: str = "") -> MonsterSheet:
     """
     解析怪物图鉴图片 (Stat Block)
     """
-    base64_image = encode_image(image_bytes)
+    image_url = await asyncio.to_thread(encode_image, image_bytes)
 
     system_prompt = """
     You are an expert D&D 5e Scribe. 
@@ -90,19 +167,13 @@ def parse_monster_image(image_bytes: bytes, user_context: str = "") -> MonsterSh
     """
 
     try:
-        completion = client.beta.chat.completions.parse(
+        completion = await get_client().beta.chat.completions.parse(
             model="gpt-4o-2024-08-06", 
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": [
                     {"type": "text", "text": f"Context: {user_context}\n\nPlease parse this monster stat block."},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
-                            "detail": "high"
-                        }
-                    }
+                    {"type": "image_url", "image_url": image_url}
                 ]}
             ],
             response_format=MonsterSheet,
@@ -0,0 +1,290 @@
+# app/services/story_cache.py
+"""
+剧本生成结果缓存（两级）：
+1. 精确命中：sha256(原文.strip()) -> 之前生成的 story_data，直接返回
+2. 语义命中：原文 embedding 与已缓存剧本做余弦相似度
+   - >= SEMANTIC_HIT：视为同一份剧本，直接返回
+   - SEMANTIC_VERIFY ~ SEMANTIC_HIT：灰区，用便宜模型问一句“是不是同一个冒险”
+   - 更低：未命中，走完整生成
+
+条目落盘在 data/story_cache/{hash}.json，重启后仍然有效，超过 TTL 自动清理。
+语义部分只在 OpenAI 下启用（DeepSeek 没有 embeddings 接口），任何失败都只是退化为未命中。
+磁盘上缺 embedding 的条目在首次语义查找时按批补算（embed_many），不逐条请求。
+轻微改动过的剧本也可能语义命中、拿回旧结果：需要重新生成时调用方传 no_cache
+（generate_story_from_text / 创建剧本接口的 ?no_cache=true）跳过查找，新结果照常写入并覆盖旧条目。
+
+temperature/seed 约定：story_generator 以 temperature=0、top_p=1、固定 seed 调用模型，
+同一原文重新生成也会得到（几乎）相同的结果，所以直接返回缓存不会让用户看到“另一种”剧本。
+改动这些生成参数或 prompt 时，应清空 data/story_cache。
+"""
+import hashlib
+import logging
+import operator
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+try:
+    # 可选：有 numpy 时语义查找是一次矩阵乘法，没有就逐条点积
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from app.config import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = DATA_DIR / "story_cache"
+
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 256
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# 单次 embeddings 请求的输入条数上限
+EMBEDDING_BATCH_SIZE = 100
+VERIFY_MODEL = "gpt-4o-mini"
+SEMANTIC_HIT = 0.95
+SEMANTIC_VERIFY = 0.85
+
+VERIFY_PROMPT = (
+    "You compare two D&D adventure texts. "
+    "Answer 'yes' if they describe the same adventure (same scenes, encounters and order) "
+    "and differ only in formatting or trivial wording. Otherwise answer 'no'. "
+    "Reply with a single word."
+)
+
+
+def text_key(raw_text: str) -> str:
+    return hashlib.sha256(raw_text.strip().encode("utf-8")).hexdigest()
+
+
+def _dot(a: List[float], b: List[float]) -> float:
+    # OpenAI 的 embedding 已经归一化，点积就是余弦相似度
+    return sum(map(operator.mul, a, b))
+
+
+class _Entry:
+    __slots__ = ("created", "text", "embedding", "story")
+
+    def __init__(self, created: float, text: str, embedding: Optional[List[float]], story: bytes):
+        self.created = created
+        self.text = text
+        self.embedding = embedding
+        # 存 JSON bytes：每次命中都解析出一份新的 dict，调用方可以随意修改
+        self.story = story
+
+
+class StoryCache:
+    def __init__(self, cache_dir=CACHE_DIR, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._loaded = False
+        self._backfilled = False
+        # (keys, 矩阵)：所有带 embedding 的条目按行堆叠，条目增删时置空，下次查找重建（仅 numpy）
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    # ---------------- 公共接口 ----------------
+
+    def lookup(
+        self, raw_text: str, client=None, embedding: Optional[List[float]] = None
+    ) -> Tuple[Optional[dict], Optional[List[float]]]:
+        """
+        返回 (命中的 story_data 或 None, 原文的 embedding 或 None)。
+        embedding 在未命中时交给 store() 复用，不用再算一次；
+        调用方已经批量算好时（见 embed_many）直接传进来。
+        """
+        key = text_key(raw_text)
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                logger.info("exact hit %s", key[:12])
+                return orjson.loads(entry.story), entry.embedding
+
+        if client is None or not self._semantic_enabled():
+            return None, None
+
+        self._backfill_embeddings(client)
+
+        if embedding is None:
+            try:
+                embedding = self._embed(client, raw_text)
+            except Exception as e:
+                logger.warning("embedding failed, skip semantic lookup: %s", e)
+                return None, None
+
+        with self._lock:
+            best_key, best_score = self._nearest(embedding)
+            best = self._entries.get(best_key) if best_key else None
+
+        if best is None or best_score < SEMANTIC_VERIFY:
+            return None, embedding
+        if best_score < SEMANTIC_HIT and not self._same_adventure(client, best.text, raw_text):
+            logger.info("gray-zone miss %s (%.3f)", best_key[:12], best_score)
+            return None, embedding
+        logger.info("semantic hit %s (%.3f)", best_key[:12], best_score)
+        return orjson.loads(best.story), embedding
+
+    def store(self, raw_text: str, story_data: dict, embedding: Optional[List[float]] = None):
+        key = text_key(raw_text)
+        entry = _Entry(time.time(), raw_text, embedding, orjson.dumps(story_data))
+        with self._lock:
+            self._ensure_loaded()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._matrix = None
+            self._write_entry(key, entry)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._delete_entry(old_key)
+
+    def embed_many(self, client, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        一次请求算一批 embedding（每批最多 EMBEDDING_BATCH_SIZE 条），
+        比逐条调用省掉大部分 RPC 往返。语义缓存未启用或请求失败时返回 None 占位。
+        """
+        if client is None or not self._semantic_enabled():
+            return [None] * len(texts)
+        vectors: List[Optional[List[float]]] = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            try:
+                resp = client.embeddings.create(model=EMBEDDING_MODEL, input=batch)
+                # 返回顺序按 index 对齐输入
+                vectors.extend(d.embedding for d in sorted(resp.data, key=lambda d: d.index))
+            except Exception as e:
+                logger.warning("batch embedding failed: %s", e)
+                vectors.extend([None] * len(batch))
+        return vectors
+
+    # ---------------- 内部实现 ----------------
+
+    @staticmethod
+    def _semantic_enabled() -> bool:
+        return bool(os.getenv("OPENAI_API_KEY"))
+
+    @staticmethod
+    def _embed(client, raw_text: str) -> List[float]:
+        resp = client.embeddings.create(model=EMBEDDING_MODEL, input=raw_text)
+        return resp.data[0].embedding
+
+    @staticmethod
+    def _same_adventure(client, cached_text: str, raw_text: str) -> bool:
+        try:
+            resp = client.chat.completions.create(
+                model=VERIFY_MODEL,
+                messages=[
+                    {"role": "system", "content": VERIFY_PROMPT},
+                    {"role": "user", "content": f"Text A:\n{cached_text}\n\nText B:\n{raw_text}"},
+                ],
+                temperature=0,
+                max_tokens=1,
+            )
+            return (resp.choices[0].message.content or "").strip().lower().startswith("y")
+        except Exception as e:
+            logger.warning("verify call failed, treat as miss: %s", e)
+            return False
+
+    def _backfill_embeddings(self, client):
+        """
+        首次语义查找时，给磁盘上没有 embedding 的条目（例如当时没开 OpenAI、或 embedding 请求失败）
+        统一补算：走 embed_many 按批请求，不逐条调用。每个进程只做一次，失败的下次启动再试。
+        """
+        with self._lock:
+            if self._backfilled:
+                return
+            self._backfilled = True
+            pending = [(k, e) for k, e in self._entries.items() if e.embedding is None and not self._expired(e)]
+        if not pending:
+            return
+        vectors = self.embed_many(client, [e.text for _, e in pending])
+        with self._lock:
+            filled = 0
+            for (key, entry), vec in zip(pending, vectors):
+                if vec is None or self._entries.get(key) is not entry:
+                    continue
+                entry.embedding = vec
+                self._write_entry(key, entry)
+                filled += 1
+            if filled:
+                self._matrix = None
+        logger.info("backfilled %d/%d embeddings", filled, len(pending))
+
+    def _nearest(self, embedding: List[float]) -> Tuple[Optional[str], float]:
+        """返回与 embedding 最相似的未过期条目 (key, score)，调用方持有锁"""
+        if NUMPY_AVAILABLE:
+            if self._matrix is None:
+                keys = [k for k, e in self._entries.items() if e.embedding is not None]
+                vecs = np.array([self._entries[k].embedding for k in keys], dtype=np.float32) if keys else None
+                self._matrix = (keys, vecs)
+            keys, vecs = self._matrix
+            if not keys:
+                return None, 0.0
+            scores = vecs @ np.asarray(embedding, dtype=np.float32)
+            # 从高分往低分找第一个没过期的条目
+            for i in np.argsort(scores)[::-1]:
+                if not self._expired(self._entries[keys[i]]):
+                    return keys[i], float(scores[i])
+            return None, 0.0
+
+        best_key, best_score = None, 0.0
+        for k, e in self._entries.items():
+            if e.embedding is None or self._expired(e):
+                continue
+            score = _dot(embedding, e.embedding)
+            if score > best_score:
+                best_key, best_score = k, score
+        return best_key, best_score
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.time() - entry.created > self.ttl
+
+    def _ensure_loaded(self):
+        """首次使用时从磁盘载入未过期的条目（调用方持有锁）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.cache_dir.exists():
+            return
+        files = sorted(self.cache_dir.glob("*.json"), key=lambda f: f.stat().st_mtime)
+        for f in files:
+            try:
+                data = orjson.loads(f.read_bytes())
+                entry = _Entry(data["created"], data["text"], data.get("embedding"), orjson.dumps(data["story"]))
+            except Exception as e:
+                logger.warning("skip unreadable cache entry %s: %s", f.name, e)
+                continue
+            if self._expired(entry):
+                f.unlink(missing_ok=True)
+                continue
+            self._entries[f.stem] = entry
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._delete_entry(old_key)
+        self._matrix = None
+
+    def _write_entry(self, key: str, entry: _Entry):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / f"{key}.json").write_bytes(
+            orjson.dumps({
+                "created": entry.created,
+                "text": entry.text,
+                "embedding": entry.embedding,
+                "story": orjson.Fragment(entry.story),
+            })
+        )
+
+    def _delete_entry(self, key: str):
+        (self.cache_dir / f"{key}.json").unlink(missing_ok=True)
+
+
+story_cache = StoryCache()
@@ -1,285 +1,503 @@
 # app/services/story_generator.py
+import functools
 import json
+import logging
 import os
 import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+import httpx
+import openai
+import orjson
 from openai import OpenAI
 from app.api.deepseek import DeepSeek
-from app.engine.story import StoryGraph # 引用你的核心类
+from app.engine.prompts import SYSTEM_PROMPT, FEW_SHOT_MESSAGES
+from app.engine.story import StoryGraph
+from app.schemas import StoryNode
+from app.services.story_cache import story_cache
+
+logger = logging.getLogger(__name__)
+
+try:
+    # openai SDK 自带的依赖；partial 模式可以解析还没收完的 JSON
+    import jiter
+    JITER_AVAILABLE = True
+except ImportError:
+    JITER_AVAILABLE = False
+
+try:
+    # langchain-openai 的依赖；只用来在第一次调用 LLM 前数一次前缀 token
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# ======================================================
+# 0. 结构化输出：场景列表的 JSON Schema（与 app.schemas.StoryNode 对应）
+# ======================================================
+# strict 模式要求每个对象列出全部字段且不允许额外字段，
+# 所以这里手写 LLM 需要产出的那部分（entity.extra / image_path 等由后续流程补）。
+# 顶层必须是 object，场景列表包在 "scenes" 里，解析时再拆出来
+def _strict_object(properties: dict) -> dict:
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+_NULLABLE_STR = {"type": ["string", "null"]}
+
+SCENE_SCHEMA = _strict_object({
+    "id": {"type": "string"},
+    "title": {"type": "string"},
+    "type": {"type": "string", "enum": ["encounter", "roleplay", "transition", "combat", "puzzle", "destination"]},
+    "min_turns": {"type": "integer"},
+    "read_aloud": {"type": "string"},
+    "gm_guidance": {"type": "string"},
+    "environment": _strict_object({
+        "light": {"type": "string"},
+        "terrain": {"type": "string"},
+        "sound": {"type": "string"},
+        "notes": _NULLABLE_STR,
+    }),
+    "entities": {"type": "array", "items": _strict_object({
+        "name": {"type": "string"},
+        "type": {"type": "string"},
+        "ref_slug": _NULLABLE_STR,
+        "count": {"type": "integer"},
+        "state": {"type": "string"},
+        "disposition": {"type": "string"},
+    })},
+    "options": {"type": "array", "items": {"type": "string"}},
+    "interactions": {"type": "array", "items": _strict_object({
+        "trigger": {"type": "string"},
+        "mechanic": {"type": "string"},
+        "success": {"type": "string"},
+        "failure": _NULLABLE_STR,
+    })},
+    "loot": {"type": "array", "items": _strict_object({
+        "item": {"type": "string"},
+        "quantity": {"type": "integer"},
+        "description": _NULLABLE_STR,
+    })},
+    "edges": {"type": "array", "items": _strict_object({
+        "to": {"type": "string"},
+        "weight": {"type": "number"},
+        "label": {"type": "string"},
+        "condition": _NULLABLE_STR,
+    })},
+})
+
+SCENE_LIST_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "scene_list",
+        "strict": True,
+        "schema": _strict_object({"scenes": {"type": "array", "items": SCENE_SCHEMA}}),
+    },
+}
+
+# 生成参数固定：temperature=0 + 固定 seed，重复提交时输出稳定，缓存的结果和重新生成的一致
+GENERATION_SEED = 42
 
 if os.getenv("OPENAI_API_KEY"):
     MODEL_NAME = "gpt-5.1"
-    client = OpenAI()
-elif os.getenv("DEEPSEEK_API_KEY"):
-    MODEL_NAME = "deepseek-chat" 
-    client = DeepSeek()
+    # SYSTEM_PROMPT + few-shot 示例是每次都相同的长前缀（远超 1024 token 的缓存门槛）：带上固定的 cache key，
+    # 让 OpenAI 把这些请求路由到同一份前缀缓存上。
+    # 所有固定说明都放在 system 里，user 消息只有原文，prefix 不随请求变化
+    # response_format：由模型的约束解码保证输出符合 schema，不再有格式错误导致的重试
+    # seed：配合 temperature=0 让同一输入尽量得到同一输出（见 story_cache 的 temperature/seed 约定）
+    CREATE_KWARGS = {"prompt_cache_key": "aidm-story-gen-v1", "response_format": SCENE_LIST_FORMAT, "seed": GENERATION_SEED}
+    # 先用便宜的小模型起草；加载/校验失败时再用 MODEL_NAME 重做一次
+    DRAFT_MODEL_NAME = "gpt-4o-mini"
 else:
+    MODEL_NAME = "deepseek-chat"
+    DRAFT_MODEL_NAME = None
+    # DeepSeek 自动做前缀缓存，也不认识 prompt_cache_key；
+    # 它没有 json_schema 模式，只靠 prompt 约束输出格式，由 clean_json_text / parse_scene_list 兜底
+    CREATE_KWARGS = {}
+
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> OpenAI:
+    """
+    第一次生成剧本时才创建 client（连接池、SSL context），之后一直复用。
+    不做 LLM 调用的进程不再为它付启动开销，缺 key 也只在真正调用时才报错。
+    """
+    log_prefix_tokens()
+    if os.getenv("OPENAI_API_KEY"):
+        return OpenAI()
+    if os.getenv("DEEPSEEK_API_KEY"):
+        return DeepSeek()
     raise ValueError("No API key found for OpenAI or DeepSeek")
 
 # ======================================================
-# 1. 继承自 test_story_gen.py 的 SYSTEM_PROMPT
+# 1. SYSTEM_PROMPT + few-shot 示例：与 tests/test_story_gen.py 共用 app/engine/prompts.py
 # ======================================================
-SYSTEM_PROMPT = """
-# Role
-You are an expert AI Dungeon Master and Data Architect. Your task is to convert unstructured D&D adventure text into a fully structured, playable JSON Graph.
-
-# Core Directive: Inference & Completion
-The input text may be narrative and lack explicit structured data. **You must infer missing details based on context.**
-1. **Environment**: If the text says "stormy", infer `sound="Thunder"`, `light="Dim"`.
-2. **Mechanics**: Create `InteractionSpec` for challenges even if specific DCs aren't listed (estimate based on difficulty).
-3. **Transitions**: Invent logical IDs if explicit scene transitions aren't named.
-
-# Data Structure Rules
-
-## 1. Scene Segmentation
-Break the text into a **JSON List** of Scene Nodes. Do not create duplicated same node and do not create redundent node!! Important: YOU MUST create a directed acyclic graph, which means you cannot backtrack. Create a new node whenever:
-* The location changes.
-* A specific encounter (Combat/Social) begins.
-* The narrative "chapter" shifts.
-Important: YOU MUST create a directed acyclic graph!
-
-## 2. Field Extraction Guidelines
-* **id**: Snake_case unique identifier (e.g., `merrow_encounter`).
-* **type**: `encounter`, `roleplay`, `transition`, `combat`, `puzzle` or `destination`.
-
-- "roleplay":
-  Pure social or narrative scenes. Focus on dialogue, characterization, and free-form description. Do NOT start initiative or detailed combat here, even if tensions are high. You may foreshadow danger, but keep it conversational.
-
-- "transition":
-  Short connective scenes that move the party from one situation or location to the next (travel, time skips, scene wrap-ups). Keep these brief and focused on pacing and mood. Usually there is no complex rules interaction here.
-
-- "encounter":
-  A structured scene with a clear situation or opposition (monsters, hazards, NPCs, dilemmas), but combat is NOT guaranteed.
-  - In an encounter node, you describe the situation and then ask what the players do.
-  - The players might negotiate, trick the enemy, retreat, or use creative tactics.
-  - Combat MAY happen, but only if the players choose to attack or clearly escalate the conflict.
-  - If the story graph has a child node of type "combat", you should only move into that combat node when the fiction clearly supports starting a fight (e.g., a character explicitly attacks, or talks clearly break down).
-
-- "combat":
-  Turn-based D&D combat is happening right now.
-  - Treat this as a signal that initiative has already been rolled or must be rolled immediately.
-  - The focus is on rounds, turns, positions, and actions, not long narrative digressions.
-  - In our system, "combat" nodes are handled by the dedicated Combat Agent and the frontend should switch into the fight UI.
-  - When you move the story into a node of type "combat", you should also signal that combat mode is now active so that control can pass to the Combat Agent.
-
-- "puzzle":
-  A scene centered on solving a riddle, trap, or puzzle-like situation.
-  - Emphasize clues, player reasoning, and step-by-step attempts.
-  - Avoid skipping straight to the solution unless the players clearly figure it out or fail repeatedly.
-
-- "destination":
-  The endpoint of the whole adventure.
-  - This node type signifies the conclusion of the story.
-  - This node should have no outgoing edges.
-  - Provide a satisfying wrap-up, epilogue, or summary of outcomes.
-
-* **min_turns** (Complexity Score): **CRITICAL**. Analyze the content to determine how many turns (interactions) players should spend here before the system suggests moving on.
-    * **Use the following RUBRIC to assign `min_turns`**:
-    * **2 Turn (Simple)**: Pure transition scenes, empty rooms, or simple observations. (e.g., "You walk down the hallway.")
-    * **3 Turns (Standard)**: Minor interactions, investigating a room with loot, or talking to a simple NPC.
-    * **4 Turns (Complex)**: Standard combat encounters (e.g., 3 Zombies), puzzles with 1-2 steps, or important NPC negotiations.
-    * **6-7 Turns (Major)**: Boss fights, complex multi-stage puzzles, or major lore dumps requiring multiple questions.
-
-* **read_aloud**: Extract text explicitly meant to be read to players (often in boxes or quotes).
-    * *Constraint*: Do NOT put rules, secrets, or enemy stats here.
-
-* **gm_guidance**: **CRITICAL FIELD**. This acts as the "Brain" for the runtime AI.
-    * **DO NOT SUMMARIZE**. Extract all detailed instructions.
-    * **Include Context**: Specific details about the setting (e.g., "Blood-red sunrise").
-    * **Include Logic Branches**: Explicitly state "If X happens, then Y". (e.g., "If players lose, Elder Runara rescues them.").
-    * **Include Tactics**: How enemies behave or negotiate (e.g., "Demands 400gp, DC 15 check reduces by 100gp").
-    * **Include Tips**: "Shenanigans" or creative solutions mentioned in the text.
-    * **MANDATORY**: Extract all "If/Then" logic, especially:
-        * **Success Outcomes**: What happens if they win?
-        * **Failure Outcomes**: (CRITICAL) What happens if they lose? (e.g. "Runara rescues them").
-        * **Knowledge Checks**: Any "DC X Intelligence check to know Y".
-* **environment**:
-    * `light`: "Bright", "Dim", "Darkness".
-    * `terrain`: "Normal", "Difficult (Sand)", "Water".
-    * `sound`: Inferred ambient sounds.
-
-* **entities**:
-    * Extract explicit enemies/NPCs.
-    * Only keep `name`, `count`, and generate a `ref_slug`.
-    * Infer `disposition`: "hostile", "friendly", "neutral".
-    * `state`: Initial position or activity (e.g., "Emerging from water").
-
-* **options**:
-    * A flat list of high-level choices that are **shown to the player** as buttons or menu options.
-    * Example: `["Negotiate", "Combat", "Creative Trick"]`.
-    * Every string in `options` MUST **exactly match** the `trigger` field of one object in `interactions`.
-    * The engine will use this 1-to-1 mapping: when the player chooses an option, it finds the `interaction` with the same `trigger` and uses its `mechanic` / `success` / `failure`.
-
-* **interactions**:
-    * Convert mechanics into structured objects.
-    * For **each** entry in `options`, create **one** corresponding `interaction` whose `trigger` is exactly the same text.
-    * Format:  
-      `{ "trigger": "Negotiate", "mechanic": "DC 15 Charisma", "success": "Cost reduced by 100gp", "failure": "Merrow gets angry and combat starts" }`
-    * Do **not** create extra `interaction.trigger` values that are not present in `options` (except for rare special cases you are explicitly instructed to add).
-
-* **loot**: 
-    * Extract specific items mentioned in the text.
-    * Format: `[{"item": "Health Potion", "quantity": 1, "description": "Restores 2d4+2 HP"}]`.
-    * If no items are mentioned, return `[]`.
-
-
-* **edges**: List of transitions.
-
-# Output Format
-Return **ONLY** a valid JSON List. Do not wrap in markdown blocks if possible.
-Here is an example structure:
-[
-"merrow_appears_on_deck": {
-  "id": "merrow_appears_on_deck",
-  "title": "The Merrow Boards the Ship",
-  "type": "encounter",
-  "min_turns": 4,
-  "read_aloud": "As lightning flashes across the sky, a monster hauls itself up onto the deck!\n\n“These waters belong to the Scaled Queen. I’m here to collect her tribute.”",
-  "gm_guidance": "Show the illustration of the merrow and adopt an intimidating voice when speaking its lines. Explain to the players that they can choose how to respond: fight, negotiate, trick, or attempt other creative tactics. Explicitly tell them that almost anything they try will involve rolling a d20 and adding a number from their sheet. Let the players take the lead and describe their ideas; encourage them to say what they are thinking and then translate that into actions and checks.\nUse vivid descriptions of the storm, the wet deck, and the looming merrow to keep tension high regardless of approach. This scene can become combat, negotiation, or a mix. The merrow is here to extort tribute for the Scaled Queen, not to immediately slaughter everyone, so it is willing to talk and threaten before fighting.\nIf the players ask about the Scaled Queen, have the merrow boast that she is a huge, two-headed merrow blessed by Demogorgon, the Prince of Demons. Use this to seed future fear and lore.\nIf the characters attack, transition into structured combat (see next scene). If they negotiate or use tricks, resolve via ability checks here. The encounter should be winnable and not overly lethal; the merrow is fearsome but mechanically modest.",
-  "environment": {
-    "light": "Dim",
-    "terrain": "Difficult (Wet ship deck)",
-    "sound": "Thunder, crashing waves, wind whipping sails, creaking rigging, merrow snarls",
-    "notes": null
-  },
-  "entities": [
-    {
-      "name": "Merrow Extortionist",
-      "type": "monster",
-      "ref_slug": "merrow_extortionist",
-      "count": 1,
-      "state": "Hauling itself onto the deck, looming over the characters, demanding tribute",
-      "disposition": "hostile",
-      "extra": {}
-    },
-    {
-      "name": "Ship Crew",
-      "type": "npc",
-      "ref_slug": "ship_crew_generic",
-      "count": 4,
-      "state": "Nervous and watching, ready to follow the characters’ lead if rallied",
-      "disposition": "neutral",
-      "extra": {}
-    }
-  ],
-
-  "options": [
-    "Negotiate",
-    "Combat",
-    "Creative Tactic",
-    "Ask about the Scaled Queen"
-  ],
-
-  "interactions": [
-    {
-      "trigger": "Negotiate",
-      "mechanic": "DC 15 Charisma (Persuasion, Intimidation, or Deception check, depending on approach)",
-      "success": "The merrow agrees to reduced tribute or accepts an alternative bargain. Tension remains high but full combat may be avoided.",
-      "failure": "The merrow grows impatient and hostile. It demands full tribute and is ready to attack, moving toward the combat scene."
-    },
-    {
-      "trigger": "Combat",
-      "mechanic": "No check required. Players declare attacks and initiative is rolled.",
-      "success": "Structured combat begins against the merrow (transition to the merrow combat node).",
-      "failure": "N/A – once combat is chosen, the scene must enter structured combat."
-    },
-    {
-      "trigger": "Creative Tactic",
-      "mechanic": "One or more ability checks (e.g. Athletics, Acrobatics, Performance, or others) typically DC 13–15, depending on the specific plan.",
-      "success": "The characters’ unusual tactic (rolling barrels, dropping sails, rallying crew, etc.) creates a strong advantage or bypasses tribute on clever terms, usually leading to the creative-resolution node.",
-      "failure": "The plan backfires or only partially works. The merrow becomes angry or feels mocked, and the situation is likely to escalate into combat."
-    },
-    {
-      "trigger": "Ask about the Scaled Queen",
-      "mechanic": "No check required.",
-      "success": "The merrow explains that the Scaled Queen is a huge, two-headed merrow blessed by Demogorgon, the Prince of Demons, seeding future fear and lore.",
-      "failure": "N/A – the merrow is eager to boast about its mistress and will share this information freely."
-    }
-  ],
-  "edges": [
-    {
-      "to": "merrow_negotiation",
-      "weight": 1.0,
-      "label": "Characters attempt to negotiate or pay tribute",
-      "condition": "Players choose to talk, bargain, or intimidate rather than immediately attack"
-    },
-    {
-      "to": "merrow_combat",
-      "weight": 1.0,
-      "label": "Characters attack the merrow",
-      "condition": "Any character declares an attack or hostilities break out"
-    },
-    {
-      "to": "merrow_shenanigans",
-      "weight": 1.0,
-      "label": "Characters attempt a creative nonstandard tactic",
-      "condition": "Players propose unusual tactics like rolling barrels, dropping sails, or rallying crew"
-    }
-  ]
-},
-
-]
-
-# Important Note:
-At the end of the story you MUST create a final scene node with type="destination". 
-This node must contain an epilogue or closing summary. 
-This node must have no outgoing edges.
+# 每次请求都以这三条完全相同的消息开头，整体作为缓存前缀
+PREFIX_MESSAGES = [{"role": "system", "content": SYSTEM_PROMPT}, *FEW_SHOT_MESSAGES]
 
-"""
+# OpenAI 只缓存 >= 1024 token 的前缀；改 prompt 时前缀掉到门槛以下，缓存会悄悄失效
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+@functools.lru_cache(maxsize=1)
+def count_prefix_tokens() -> Tuple[int, bool]:
+    """
+    返回 (PREFIX_MESSAGES 的 token 数, 是否精确)。
+    用 o200k_base（gpt-4o / gpt-5 系列的编码）计数；没装 tiktoken 或词表下载不了（离线）时按 4 字符/token 估算。
+    不含每条消息的格式开销，这几个 token 对门槛判断没有影响。
+    tiktoken 第一次取词表可能要联网下载，所以不在导入时算，而是第一次调用 LLM 前（见 get_client）。
+    """
+    text = "".join(m["content"] for m in PREFIX_MESSAGES)
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return len(tiktoken.get_encoding("o200k_base").encode(text)), True
+        except Exception:
+            pass
+    return len(text) // 4, False
+
+
+def log_prefix_tokens() -> int:
+    """记录静态前缀的 token 数；低于缓存门槛时告警（结果有缓存，只算一次）"""
+    tokens, exact = count_prefix_tokens()
+    logger.info("Static prompt prefix: %d tokens%s", tokens, "" if exact else " (estimated)")
+    if tokens < PROMPT_CACHE_MIN_TOKENS:
+        logger.warning("Static prompt prefix is below the %d-token prompt cache threshold", PROMPT_CACHE_MIN_TOKENS)
+    return tokens
 
 # ======================================================
 # 2. 继承自 test_story_gen.py 的 Helper Function
 # ======================================================
+# 模块加载时编译一次，每次清洗不再查 re 的内部缓存
+_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```")
+# 空白之外连同 BOM 一起去掉：带 BOM 的文本 JSON 解析器会直接报错
+_STRIP_CHARS = " \t\r\n\ufeff"
+
 def clean_json_text(text: str) -> str:
-    """去除 markdown 符号，防止解析报错"""
-    pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
-    match = re.search(pattern, text)
-    if match:
-        return match.group(1)
-    return text.strip()
+    """去除 markdown 符号和首尾空白/BOM，防止解析报错"""
+    stripped = text.strip(_STRIP_CHARS)
+    # 常见情况（结构化输出 / 模型没加代码块）：已经是纯 JSON，跳过整段正则扫描；
+    # 这样场景文本里偶尔出现的 ``` 也不会被误当成代码块
+    if stripped[:1] in ("[", "{"):
+        return stripped
+    match = _FENCE_RE.search(stripped)
+    return match.group(1) if match else stripped
+
+def parse_scene_list(llm_output: str) -> list:
+    """
+    LLM 输出 -> 场景列表。
+    结构化输出是 {"scenes": [...]}；没有 schema 约束时（DeepSeek）可能是裸列表或单个场景。
+    """
+    try:
+        data = orjson.loads(clean_json_text(llm_output))
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON string: {e}")
+    if isinstance(data, dict):
+        return data["scenes"] if isinstance(data.get("scenes"), list) else [data]
+    return data
+
+# ------------------------------------------------------
+# 长剧本分段：按标题切成若干段并行生成，再合并成一张图
+# ------------------------------------------------------
+# 约 512 token 一段；短于 SECTION_SPLIT_MIN_CHARS 的剧本仍然一次调用
+SECTION_TARGET_CHARS = 2000
+SECTION_SPLIT_MIN_CHARS = 2 * SECTION_TARGET_CHARS
+# 同时在飞的 LLM 请求数上限
+SECTION_WORKERS = 5
+
+# 标题行：markdown 标题，或模组里常见的段落标题
+_HEADING_RE = re.compile(
+    r"^(?:#{1,6}\s+\S.*|Run the Encounter.*|Wrap Up.*|Welcome to.*)$",
+    re.MULTILINE,
+)
+# 两个以上空行视为章节分隔
+_CHAPTER_BREAK_RE = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+SECTION_PROMPT = """# Fragment Mode
+The last user message is fragment {index} of {total} of a longer adventure. Only convert this fragment.
+* Produce 1-3 scenes for this fragment.
+* The first scene id MUST be `{first_id}`. Every other scene id MUST start with `{first_id}_`.
+{next_rule}
+"""
+_NEXT_RULE = (
+    "* Scenes that lead onward MUST have an edge to `{next_id}` (the first scene of the next fragment). "
+    "Do NOT create a scene with that id and do NOT create the final destination node."
+)
+_LAST_RULE = "* This is the final fragment: end it with the destination node required above."
+
+
+def _slug(text: str) -> str:
+    return _SLUG_RE.sub("_", text.lower()).strip("_")[:40] or "section"
+
+
+def split_adventure_into_sections(text: str) -> List[str]:
+    """
+    按标题 / 章节空行把剧本切成若干段，再把相邻的短段合并到约 SECTION_TARGET_CHARS。
+    不会在段落中间切开：超长的一段保持原样。
+    """
+    text = text.strip()
+    cuts = sorted({0, *(m.start() for m in _HEADING_RE.finditer(text)), *(m.end() for m in _CHAPTER_BREAK_RE.finditer(text))})
+    pieces = [text[a:b].strip() for a, b in zip(cuts, cuts[1:] + [len(text)])]
+
+    sections: List[str] = []
+    for piece in filter(None, pieces):
+        if sections and len(sections[-1]) + len(piece) <= SECTION_TARGET_CHARS:
+            sections[-1] = f"{sections[-1]}\n\n{piece}"
+        else:
+            sections.append(piece)
+    return sections
+
+
+def _section_ids(sections: List[str]) -> List[str]:
+    """每段第一行（通常是标题）转成 snake_case，作为该段第一个场景的 id"""
+    ids, seen = [], set()
+    for i, section in enumerate(sections):
+        base = _slug(section.split("\n", 1)[0])
+        sid = base if base not in seen else f"{base}_{i + 1}"
+        seen.add(sid)
+        ids.append(sid)
+    return ids
+
+
+def _partial_scenes(text: str) -> Optional[list]:
+    """
+    用 jiter 的 partial 模式解析还没收完的输出，返回目前为止的场景列表。
+    不是裸 JSON（例如带 markdown 围栏）时返回 None，交给最后的完整解析。
+    """
+    text = text.lstrip(_STRIP_CHARS)
+    if not text or text[0] not in "[{":
+        return None
+    try:
+        data = jiter.from_json(text.encode(), partial_mode="trailing-strings")
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = data.get("scenes")
+    return data if isinstance(data, list) else []
+
+
+# 只有网络/限流这类瞬时错误值得重试（只重发请求，不重跑整条生成流程）；
+# JSON / schema 校验错误是 ValueError，不在这里重试，交给起草 -> 升级的逻辑处理。
+# APITimeoutError 是 APIConnectionError 的子类；httpx.TransportError 覆盖流读到一半断开的情况
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, httpx.TransportError)
+LLM_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+def _with_retries(fn):
+    """对 RETRYABLE_ERRORS 做指数退避重试（1s, 2s, 4s ... 封顶 RETRY_MAX_DELAY），最多 LLM_MAX_ATTEMPTS 次"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+            try:
+                return fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == LLM_MAX_ATTEMPTS:
+                    raise
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                logger.warning(
+                    "%s attempt %d/%d failed (%s: %s), retrying in %.0fs",
+                    fn.__name__, attempt, LLM_MAX_ATTEMPTS, type(e).__name__, e, delay,
+                )
+                time.sleep(delay)
+    return wrapper
+
+
+@_with_retries
+def _stream_scene_nodes(client, messages: List[dict], model: str) -> List[StoryNode]:
+    """
+    流式调用 LLM：长剧本要生成很久，边收边拼，连接不会空等整段响应。
+    每当一个场景对象闭合就立刻用 StoryNode 校验，校验和网络接收重叠进行；
+    出现不合格的场景时马上中断流，不再为剩下的 token 等待和付费。
+    """
+    # 重试由 _with_retries 统一负责：关掉 SDK 自带的重试，避免两层叠加放大请求数
+    stream = client.with_options(max_retries=0).chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0,
+        top_p=1,
+        stream=True,
+        **CREATE_KWARGS,
+    )
+    parts = []
+    nodes: List[StoryNode] = []
+    incremental = JITER_AVAILABLE
+    try:
+        for chunk in stream:
+            if not (chunk.choices and chunk.choices[0].delta.content):
+                continue
+            text = chunk.choices[0].delta.content
+            parts.append(text)
+            # 只有可能闭合了对象的 chunk 才值得重新解析
+            if incremental and "}" in text:
+                scenes = _partial_scenes("".join(parts))
+                if scenes is None:
+                    incremental = False
+                    continue
+                # 最后一个可能还没收完，只校验它之前已经闭合的场景
+                for scene in scenes[len(nodes):-1]:
+                    nodes.append(StoryNode.model_validate(scene))
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    llm_output = "".join(parts)
+    logger.debug("Raw LLM output (%s):\n%s", model, llm_output)
+    # 完整解析一次，只校验流式阶段还没校验过的尾部
+    scenes = parse_scene_list(llm_output)
+    if not isinstance(scenes, list):
+        raise ValueError("Input JSON must be a list of scene objects.")
+    nodes.extend(StoryNode.model_validate(scene) for scene in scenes[len(nodes):])
+    return nodes
+
+
+def _generate_sections(client, sections: List[str], model: str) -> List[StoryNode]:
+    """
+    每段一个请求，线程池并行（最多 SECTION_WORKERS 个同时在飞），
+    PREFIX_MESSAGES 仍在最前面，前缀缓存照常命中。
+    返回合并后的场景列表（流式阶段已校验好的 StoryNode）。
+    """
+    ids = _section_ids(sections)
+    total = len(sections)
+
+    def run(i: int) -> List[StoryNode]:
+        next_rule = _NEXT_RULE.format(next_id=ids[i + 1]) if i + 1 < total else _LAST_RULE
+        messages = [
+            *PREFIX_MESSAGES,
+            {"role": "system", "content": SECTION_PROMPT.format(index=i + 1, total=total, first_id=ids[i], next_rule=next_rule)},
+            {"role": "user", "content": sections[i]},
+        ]
+        return _stream_scene_nodes(client, messages, model)
+
+    with ThreadPoolExecutor(max_workers=SECTION_WORKERS) as pool:
+        scene_lists = list(pool.map(run, range(total)))
+    return [scene for scenes in scene_lists for scene in scenes]
 
 # ======================================================
 # 3. 核心生成逻辑 (改造适配 API)
 # ======================================================
-def generate_story_from_text(raw_text: str) -> dict:
+# 起草 / 升级次数，用来观察小模型一次通过的比例。
+# 分段/批量生成时多个线程同时计数，读写都经过 _STATS_LOCK
+GENERATION_STATS: Counter = Counter()
+_STATS_LOCK = threading.Lock()
+
+def _count_generation(outcome: str) -> dict:
+    """计数一次起草结果，返回计数后的快照（用于日志）"""
+    with _STATS_LOCK:
+        GENERATION_STATS[outcome] += 1
+        return dict(GENERATION_STATS)
+
+def _generate_nodes(client, raw_text: str, model: str) -> List[StoryNode]:
+    """
+    调用 LLM 生成场景，每个场景在流式接收时已经用 StoryNode 校验过：
+    格式不符合引擎要求会直接抛错（ValueError），避免保存了坏文件。
+    长剧本按章节切段并行生成，短剧本一次调用。
     """
-    接收文本 -> LLM -> 清洗 -> StoryGraph 校验 -> 返回 Dict
+    sections = split_adventure_into_sections(raw_text) if len(raw_text) >= SECTION_SPLIT_MIN_CHARS else []
+    if len(sections) > 1:
+        logger.info("Splitting adventure into %d sections", len(sections))
+        return _generate_sections(client, sections, model)
+    return _stream_scene_nodes(client, [
+        *PREFIX_MESSAGES,
+        {"role": "user", "content": raw_text}
+    ], model)
+
+def _build_graph(story_nodes: List[StoryNode]) -> StoryGraph:
+    """
+    把场景装进 StoryGraph 并检查整张图：分段生成时各段是分开产出的，
+    场景 id 可能重复（后者会覆盖前者）、跨段的边可能指向不存在的场景或连成环。
+    有问题抛 ValueError（和 JSON/schema 错误一样会触发起草 -> 升级），坏图不会被缓存或保存。
+    """
+    seen, duplicates = set(), []
+    for node in story_nodes:
+        if node.id in seen:
+            duplicates.append(node.id)
+        seen.add(node.id)
+    if duplicates:
+        raise ValueError(f"Duplicate scene ids: {', '.join(duplicates)}")
+
+    # 场景已经是校验过的 StoryNode，add_scenes_from_story_nodes 不会再校验一遍
+    graph = StoryGraph()
+    graph.add_scenes_from_story_nodes(story_nodes)
+    problems = graph.validate_graph()
+    if problems:
+        raise ValueError("; ".join(problems))
+    if not graph.check_is_dag():
+        raise ValueError("Story graph contains a cycle")
+    return graph
+
+def _generate_graph(client, raw_text: str, model: str) -> StoryGraph:
+    return _build_graph(_generate_nodes(client, raw_text, model))
+
+def generate_story_from_text(
+    raw_text: str, embedding: Optional[List[float]] = None, no_cache: bool = False
+) -> dict:
+    """
+    接收文本 -> LLM -> 清洗 -> StoryNode 校验 -> StoryGraph 检查并导出 -> 返回 Dict
+    embedding：调用方已经算好的原文 embedding（批量生成时），省掉一次请求
+    no_cache：跳过缓存查找强制重新生成（结果仍写入缓存，覆盖旧条目）
     """
     try:
-        # A. 调用 LLM
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"Please process the following adventure text:\n\n{raw_text}"}
-            ],
-            temperature=0.1, # 保持低温以稳定输出
-        )
-        llm_output = response.choices[0].message.content
-            # A. 先打印原始 LLM 输出
-        print("=== RAW LLM OUTPUT ===")
-        print(llm_output)
-
-        #json_str = clean_json_text(llm_output)
-        # B. 清洗数据
-        json_str = clean_json_text(llm_output)
-        
-        # C. 关键步骤：使用 StoryGraph 类进行“试加载”
-        # 这能确保生成的 JSON 格式绝对符合我们的引擎要求，
-        # 如果不符合，这里会直接抛错，避免保存了坏文件。
-        temp_graph = StoryGraph()
-        temp_graph.add_scenes_from_json_list(json_str)
-        
+        # 0. 先查缓存：同一份（或几乎相同的）剧本重复提交时不再调用 LLM
+        client = get_client()
+        if no_cache:
+            if embedding is None:
+                # 不查缓存，但写入时仍要带上 embedding，之后的语义查找才能命中
+                embedding = story_cache.embed_many(client, [raw_text])[0]
+        else:
+            cached, embedding = story_cache.lookup(raw_text, client, embedding)
+            if cached is not None:
+                return cached
+
+        # A + B + C. 调用 LLM、清洗并校验
+        # 先让小模型起草，结构或整张图不合格才升级到大模型重做
+        if DRAFT_MODEL_NAME:
+            try:
+                graph = _generate_graph(client, raw_text, DRAFT_MODEL_NAME)
+                stats = _count_generation("draft_ok")
+            except ValueError as e:  # JSON 解析错误、pydantic ValidationError 都是 ValueError
+                stats = _count_generation("escalated")
+                logger.warning("Draft model output rejected, escalating to %s: %s", MODEL_NAME, e)
+                graph = _generate_graph(client, raw_text, MODEL_NAME)
+            logger.info("Story generation stats: %s", stats)
+        else:
+            graph = _generate_graph(client, raw_text, MODEL_NAME)
+
         # D. 导出为纯 Dict (准备存入 json 文件)
-        # 我们利用 to_dict() 方法，而不是直接用 llm 的原始 json
-        story_data = temp_graph.to_dict()
-        
-        # E. 补全根级别的字段 (因为 StoryGraph 只管 nodes)
-        # 我们需要手动在外层包一个结构，或者让 to_dict() 包含它
-        # 这里我们假设 StoryGraph.to_dict() 返回的是 {"nodes": {...}}
-        
+        # 必须经过 StoryGraph.to_dict()：story.json 的格式（environment 补齐默认值、
+        # entity.extra 为 {} 等）由它统一，ai_dm 等读取方按这个格式直接读 dict。
+        # 外层的 story id/title 等字段由调用方（routes）包一层，这里只管 nodes
+        story_data = graph.to_dict()
+
+        # 只缓存通过校验的结果
+        story_cache.store(raw_text, story_data, embedding)
         return story_data
 
     except Exception as e:
         print(f"Error inside generate_story_from_text: {e}")
         # 在实际 API 中，最好抛出 HTTPException，这里先返回 None 让 Route 处理
-        raise e
\ No newline at end of file
+        raise e
+
+# 批量生成时同时处理的剧本数上限（每个剧本内部还会按章节并行）
+BATCH_WORKERS = 8
+
+def generate_many(raw_texts: List[str], no_cache: bool = False) -> List[Union[dict, Exception]]:
+    """
+    批量生成：一次 embeddings 请求算完所有原文的向量，再用线程池并行生成。
+    结果按输入顺序返回；单个剧本失败时对应位置是异常对象，不影响其它剧本。
+    no_cache 对整批生效，见 generate_story_from_text。
+    """
+    if not raw_texts:
+        return []
+    embeddings = story_cache.embed_many(get_client(), raw_texts)
+
+    def run(i: int) -> Union[dict, Exception]:
+        try:
+            return generate_story_from_text(raw_texts[i], embeddings[i], no_cache=no_cache)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(raw_texts))) as pool:
+        return list(pool.map(run, range(len(raw_texts))))
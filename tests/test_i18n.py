@@ -0,0 +1,50 @@
+# test_i18n.py
+import os
+import string
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app.engine.i18n import _load_prompts, compiled_combat, format_text, get_text
+
+SAMPLE_VALUES = {
+    "attacker": "Tordek",
+    "target": "Goblin",
+    "weapon": "Warhammer",
+    "d20": 17,
+    "bonus": 5,
+    "total": 22,
+    "ac": 15,
+    "result": "HIT",
+    "expr": "1d8+3",
+}
+
+
+@pytest.mark.parametrize("lang", ["en", "zh"])
+def test_compiled_combat_matches_str_format(lang):
+    for key, tmpl in _load_prompts(lang)["combat_log"].items():
+        fields = {f for _, f, _, _ in string.Formatter().parse(tmpl) if f is not None}
+        assert fields <= SAMPLE_VALUES.keys(), (lang, key, fields)
+        # 全部样例值都传进去：模板用不到的参数和 str.format 一样被忽略
+        kwargs = dict(SAMPLE_VALUES, unused_extra="ignored")
+        assert compiled_combat(lang, key)(**kwargs) == tmpl.format(**kwargs), (lang, key)
+
+
+def test_format_text_unhashable_args_skip_cache():
+    text = format_text("en", "dm_narrative", "combat_begins", enemy_name=["Goblin"])
+    assert text == get_text("en", "dm_narrative", "combat_begins").format(enemy_name=["Goblin"])
+
+
+def test_format_text_surfaces_formatting_errors():
+    calls = []
+
+    class BadValue:
+        def __format__(self, spec):
+            calls.append(spec)
+            raise TypeError("bad value")
+
+    with pytest.raises(TypeError, match="bad value"):
+        format_text("en", "dm_narrative", "combat_begins", enemy_name=BadValue())
+    # 不再吞掉错误后用同样的参数再格式化一遍
+    assert len(calls) == 1
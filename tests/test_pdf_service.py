@@ -0,0 +1,79 @@
+# test_pdf_service.py
+import io
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PIL import Image
+
+import app.services.pdf_service as pdf_service
+from app.services.pdf_service import VISION_MAX_SIDE, _prepare_image
+
+
+def image_bytes(fmt, size=(40, 20), **save_kwargs):
+    buf = io.BytesIO()
+    img = Image.new("RGB", size, "red")
+    if fmt == "MPO":
+        # 双帧才会被识别成 MPO（手机相机的 JPEG 常带第二帧预览图）
+        save_kwargs.update(save_all=True, append_images=[img])
+    img.save(buf, format=fmt, **save_kwargs)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("fmt, mime", [("PNG", "image/png"), ("JPEG", "image/jpeg"), ("GIF", "image/gif"), ("WEBP", "image/webp")])
+def test_supported_small_images_pass_through(fmt, mime):
+    data = image_bytes(fmt)
+    assert _prepare_image(data) == (data, mime, "low")
+
+
+@pytest.mark.parametrize("fmt", ["BMP", "TIFF", "MPO"])
+def test_unsupported_formats_are_reencoded_as_jpeg(fmt):
+    original = image_bytes(fmt)
+    assert Image.open(io.BytesIO(original)).format == fmt
+    data, mime, detail = _prepare_image(original)
+    assert mime == "image/jpeg"
+    assert detail == "low"
+    assert Image.open(io.BytesIO(data)).format == "JPEG"
+
+
+def test_small_rotated_photo_is_transposed():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: 顺时针转 90 度显示
+    data, mime, _ = _prepare_image(image_bytes("JPEG", exif=exif))
+    assert mime == "image/jpeg"
+    assert Image.open(io.BytesIO(data)).size == (20, 40)
+
+
+def test_large_images_are_downscaled():
+    data, mime, detail = _prepare_image(image_bytes("PNG", size=(VISION_MAX_SIDE * 2, 100)))
+    assert (mime, detail) == ("image/jpeg", "high")
+    assert max(Image.open(io.BytesIO(data)).size) == VISION_MAX_SIDE
+
+
+@pytest.fixture
+def b64_cache(monkeypatch):
+    monkeypatch.setattr(pdf_service, "_B64_CACHE", pdf_service.OrderedDict())
+    monkeypatch.setattr(pdf_service, "_b64_cache_bytes", 0)
+    return pdf_service._B64_CACHE
+
+
+def test_b64_cache_is_bounded_by_bytes(b64_cache, monkeypatch):
+    images = [image_bytes("PNG", size=(40 + i, 20)) for i in range(4)]
+    monkeypatch.setattr(pdf_service, "_B64_CACHE_MAX_BYTES", 0)
+    url_size = len(pdf_service.encode_image(images[0])["url"])
+    # 大约能放下两张
+    monkeypatch.setattr(pdf_service, "_B64_CACHE_MAX_BYTES", url_size * 2 + url_size // 2)
+
+    for data in images:
+        pdf_service.encode_image(data)
+    assert len(b64_cache) == 2
+    assert pdf_service._b64_cache_bytes == sum(len(v["url"]) for v in b64_cache.values())
+    assert pdf_service._b64_cache_bytes <= pdf_service._B64_CACHE_MAX_BYTES
+
+
+def test_b64_cache_skips_oversized_images(b64_cache, monkeypatch):
+    monkeypatch.setattr(pdf_service, "_B64_CACHE_MAX_BYTES", 10)
+    encoded = pdf_service.encode_image(image_bytes("PNG"))
+    assert encoded["url"].startswith("data:image/png;base64,")
+    assert not b64_cache
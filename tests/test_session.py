@@ -0,0 +1,302 @@
+# test_session.py
+import os
+import subprocess
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+import pytest
+from pydantic import ValidationError
+
+import app.engine.session as session_mod
+from app.engine import character_store
+from app.schemas import PlayerState
+
+
+SHEET = {
+    "name": "Tordek",
+    "race": "Dwarf",
+    "class": "Cleric",
+    "background": "Acolyte",
+    "alignment": "Lawful Good",
+    "hp_max": 11,
+    "ac": 18,
+    "speed": 25,
+    "initiative": 0,
+    "proficiency_bonus": 2,
+    "abilities": {"strength": 14, "dexterity": 8, "constitution": 15, "intelligence": 10, "wisdom": 16, "charisma": 12},
+    "equipment": ["Mace", "Shield"],
+    "background_story": "Raised in a mountain temple.",
+}
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    """会话和角色卡都写到临时目录，不碰 data/"""
+    sessions = tmp_path / "sessions"
+    sessions.mkdir()
+    sheets = tmp_path / "character_sheets"
+    monkeypatch.setattr(session_mod, "SESSIONS_DIR", sessions)
+    monkeypatch.setattr(character_store, "SHEETS_DIR", sheets)
+    character_store._load_sheet.cache_clear()
+    yield sessions, sheets
+    character_store._load_sheet.cache_clear()
+
+
+def write_old_save(sessions, session_id="old1"):
+    """旧格式存档：players 里内嵌完整角色卡，没有 character_sheet_id"""
+    data = {
+        "session_id": session_id,
+        "story_id": "story",
+        "title": "Old Journey",
+        "current_node_id": "start",
+        "players": [{"name": "Tordek", "character_sheet": SHEET, "current_hp": 9}],
+        "chat_history": [{"role": "user", "content": "hi"}],
+        "created_at": "2025-01-01T00:00:00",
+        "updated_at": "2025-01-01T00:00:00",
+    }
+    (sessions / f"{session_id}.json").write_bytes(orjson.dumps(data))
+    return data
+
+
+def test_validation_has_no_side_effects(dirs):
+    _, sheets = dirs
+    with pytest.raises(ValidationError):
+        PlayerState.model_validate({"name": "x", "character_sheet": SHEET, "current_hp": 1})
+    assert not sheets.exists()
+
+
+def test_old_embedded_save_round_trip(dirs):
+    sessions, sheets = dirs
+    write_old_save(sessions)
+
+    session = session_mod.SessionManager().load_session("old1")
+    player = session.players[0]
+    assert player.character_sheet_id
+    assert player.current_hp == 9
+    assert player.character_sheet.name == "Tordek"
+    assert player.character_sheet.class_name == "Cleric"
+    assert (sheets / f"{player.character_sheet_id}.json").exists()
+
+
+def test_resaved_migrated_session_stores_only_id(dirs):
+    sessions, _ = dirs
+    write_old_save(sessions)
+    manager = session_mod.SessionManager()
+    session = manager.load_session("old1")
+    sheet_id = session.players[0].character_sheet_id
+
+    manager.save_session(session)
+    manager.flush()
+
+    stored = orjson.loads((sessions / "old1.json").read_bytes())["players"][0]
+    assert "character_sheet" not in stored
+    assert stored["character_sheet_id"] == sheet_id
+    # 新的管理器（无缓存）从只有 id 的存档读回
+    reloaded = session_mod.SessionManager().load_session("old1")
+    assert reloaded.players[0].character_sheet.name == "Tordek"
+
+
+def test_save_sheet_dedups_by_content(dirs):
+    _, sheets = dirs
+    sheet = character_store.CharacterSheet.model_validate(SHEET)
+    first = character_store.save_sheet(sheet)
+    second = character_store.save_sheet(character_store.CharacterSheet.model_validate(dict(SHEET)))
+    assert first == second
+    assert len(list(sheets.iterdir())) == 1
+
+    other = character_store.save_sheet(character_store.CharacterSheet.model_validate({**SHEET, "ac": 16}))
+    assert other != first
+    assert len(list(sheets.iterdir())) == 2
+
+
+def make_session(session_id="s1", sheet_id="sheet"):
+    return session_mod.GameSession(
+        session_id=session_id,
+        story_id="story",
+        title="Journey",
+        current_node_id="start",
+        players=[PlayerState(name="Tordek", character_sheet_id=sheet_id, current_hp=10, inventory=["Mace"])],
+        enemy_states={"goblin": {"damage_taken": 0}},
+        created_at="2025-01-01T00:00:00",
+        updated_at="2025-01-01T00:00:00",
+    )
+
+
+def test_load_after_save_before_flush(dirs):
+    sessions, _ = dirs
+    manager = session_mod.SessionManager()
+    session = make_session()
+    session.chat_history.append({"role": "user", "content": "hello"})
+    manager.save_session(session)
+
+    # 防抖窗口内还没落盘，读到的是内存里的最新版本
+    assert not (sessions / "s1.json").exists()
+    loaded = manager.load_session("s1")
+    assert loaded.chat_history == [{"role": "user", "content": "hello"}]
+    assert loaded is not session
+
+    manager.flush()
+    assert orjson.loads((sessions / "s1.json").read_bytes())["chat_history"][0]["content"] == "hello"
+
+
+def test_zero_debounce_writes_synchronously(dirs, monkeypatch):
+    sessions, _ = dirs
+    monkeypatch.setattr(session_mod, "SAVE_DEBOUNCE_SECONDS", 0)
+    session_mod.SessionManager().save_session(make_session())
+    assert (sessions / "s1.json").exists()
+
+
+def test_flush_on_exit(dirs):
+    sessions, _ = dirs
+    # 子进程保存后直接退出（防抖计时器还没到点），靠 atexit 写盘
+    code = (
+        "import sys, pathlib\n"
+        "sys.path.insert(0, sys.argv[2])\n"
+        "import app.engine.session as s\n"
+        "s.SESSIONS_DIR = pathlib.Path(sys.argv[1])\n"
+        "s.SAVE_DEBOUNCE_SECONDS = 60\n"
+        "sys.path.insert(0, sys.argv[3])\n"
+        "from test_session import make_session\n"
+        "s.SessionManager().save_session(make_session('exit1'))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, "-c", code, str(sessions), root, os.path.dirname(os.path.abspath(__file__))],
+        check=True, cwd=root,
+    )
+    data = orjson.loads((sessions / "exit1.json").read_bytes())
+    assert data["session_id"] == "exit1"
+    assert "exit1" in orjson.loads((sessions / session_mod.INDEX_FILENAME).read_bytes())
+
+
+def test_working_copies_are_isolated(dirs):
+    manager = session_mod.SessionManager()
+    manager.save_session(make_session())
+    manager.flush()
+
+    first = manager.load_session("s1")
+    first.players[0].inventory.append("Rope")
+    first.players[0].conditions.append("poisoned")
+    first.players[0].current_hp = 1
+    first.enemy_states["goblin"]["damage_taken"] = 5
+    first.chat_history.append({"role": "user", "content": "x"})
+
+    # 缓存里的版本不受影响
+    second = manager.load_session("s1")
+    assert second.players[0].inventory == ["Mace"]
+    assert second.players[0].conditions == []
+    assert second.players[0].current_hp == 10
+    assert second.enemy_states["goblin"]["damage_taken"] == 0
+    assert second.chat_history == []
+
+
+def test_trim_history_tolerates_none_content(dirs):
+    manager = session_mod.SessionManager()
+    session = make_session()
+    session.chat_history = [
+        {"role": "assistant", "content": None},
+        {"role": "tool"},
+        *({"role": "user", "content": f"m{i}"} for i in range(session_mod.MAX_HISTORY)),
+    ]
+    manager.save_session(session)
+    manager.flush()
+
+    assert len(session.chat_history) == session_mod.MAX_HISTORY
+    assert session.chat_summary.splitlines() == ["assistant: ", "tool: "]
+
+
+def test_list_sessions_follows_files_changed_outside_manager(dirs):
+    sessions, _ = dirs
+    manager = session_mod.SessionManager()
+    for sid in ("a1", "b2"):
+        manager.save_session(make_session(sid))
+    assert {s["id"] for s in manager.list_sessions()} == {"a1", "b2"}
+
+    # 手动删掉一个存档、另一个进程写入一个新存档：索引里都还没有记录
+    (sessions / "a1.json").unlink()
+    other = make_session("c3")
+    (sessions / "c3.json").write_bytes(orjson.dumps(other.model_dump(mode="json", exclude=session_mod._SAVE_EXCLUDE)))
+
+    listed = manager.list_sessions()
+    assert {s["id"] for s in listed} == {"b2", "c3"}
+    assert set(orjson.loads((sessions / session_mod.INDEX_FILENAME).read_bytes())) == {"b2", "c3"}
+    # 新的管理器从磁盘上的索引读到同样的结果
+    assert {s["id"] for s in session_mod.SessionManager().list_sessions()} == {"b2", "c3"}
+
+
+def test_load_during_flush_sees_pending_save(dirs, monkeypatch):
+    manager = session_mod.SessionManager()
+    manager.save_session(make_session())
+    manager.flush()
+
+    session = manager.load_session("s1")
+    session.chat_history.append({"role": "user", "content": "new"})
+    manager.save_session(session)
+
+    # 写盘进行到一半时读取：还没写完的版本必须仍从 _dirty 返回，而不是磁盘上的旧缓存
+    seen = []
+    write_sync = manager._write_sync
+    def slow_write(s):
+        seen.append(manager.load_session("s1").chat_history)
+        return write_sync(s)
+    monkeypatch.setattr(manager, "_write_sync", slow_write)
+    manager.flush()
+    assert seen == [[{"role": "user", "content": "new"}]]
+    assert manager.load_session("s1").chat_history == [{"role": "user", "content": "new"}]
+
+
+def test_save_during_flush_stays_dirty(dirs, monkeypatch):
+    manager = session_mod.SessionManager()
+    first = make_session()
+    manager.save_session(first)
+
+    newer = make_session()
+    newer.title = "Newer"
+    write_sync = manager._write_sync
+    def racing_write(s):
+        mtime = write_sync(s)
+        if s is first:
+            manager.save_session(newer)
+        return mtime
+    monkeypatch.setattr(manager, "_write_sync", racing_write)
+    manager.flush()
+    # 写盘期间进来的新版本没有被当作已落盘丢掉
+    assert manager.load_session("s1").title == "Newer"
+    manager.flush()
+    assert session_mod.SessionManager().load_session("s1").title == "Newer"
+
+
+def test_session_cache_is_bounded(dirs, monkeypatch):
+    monkeypatch.setattr(session_mod, "MAX_CACHED_SESSIONS", 3)
+    manager = session_mod.SessionManager()
+    for i in range(5):
+        manager.save_session(make_session(f"s{i}"))
+    manager.flush()
+    for i in range(5):
+        manager.load_session(f"s{i}")
+    assert list(manager._cache) == ["s2", "s3", "s4"]
+
+
+def test_session_response_includes_character_sheet(dirs):
+    sessions, _ = dirs
+    write_old_save(sessions)
+    session = session_mod.SessionManager().load_session("old1")
+
+    # GET /sessions/{id} 的 response_model 输出：仍带完整角色卡（按别名输出 "class"）
+    player = session_mod.GameSession.model_validate(session).model_dump(mode="json", by_alias=True)["players"][0]
+    assert player["character_sheet"]["name"] == "Tordek"
+    assert player["character_sheet"]["class"] == "Cleric"
+    assert player["character_sheet_id"] == session.players[0].character_sheet_id
+
+
+def test_character_sheets_are_not_shared_between_sessions(dirs):
+    sheet_id = character_store.save_sheet(character_store.CharacterSheet.model_validate(SHEET))
+    first = make_session("s1", sheet_id)
+    second = make_session("s2", sheet_id)
+
+    first.players[0].character_sheet.equipment.append("Rope")
+    sheet = first.players[0].character_sheet
+    sheet.ac = 1
+    assert second.players[0].character_sheet.ac == 18
+    assert second.players[0].character_sheet.equipment == ["Mace", "Shield"]
@@ -0,0 +1,115 @@
+# test_story_cache.py
+import math
+import os
+import sys
+import types
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app.services.story_cache as story_cache_mod
+from app.services.story_cache import StoryCache, text_key
+
+STORY = {"nodes": {"start": {"id": "start", "title": "Start"}}}
+
+
+def unit(*xs):
+    norm = math.sqrt(sum(x * x for x in xs))
+    return [x / norm for x in xs]
+
+
+class FakeClient:
+    """embeddings 按原文查表；verify 调用返回固定答案，并记录调用次数"""
+    def __init__(self, vectors, verify_answer="no"):
+        self.vectors = vectors
+        self.verify_answer = verify_answer
+        self.calls = {"emb": 0, "verify": 0}
+        self.embeddings = types.SimpleNamespace(create=self._embed)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._verify))
+
+    def _embed(self, model, input):
+        self.calls["emb"] += 1
+        texts = input if isinstance(input, list) else [input]
+        return types.SimpleNamespace(data=[
+            types.SimpleNamespace(embedding=self.vectors[t], index=i) for i, t in enumerate(texts)
+        ])
+
+    def _verify(self, **kwargs):
+        self.calls["verify"] += 1
+        message = types.SimpleNamespace(content=self.verify_answer)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # 语义部分只在有 OpenAI key 时启用
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    return StoryCache(cache_dir=tmp_path / "story_cache")
+
+
+def test_exact_hit_needs_no_client(cache):
+    cache.store("  The adventure.\n", STORY)
+    story, _ = cache.lookup("The adventure.", client=None)
+    assert story == STORY
+    # 每次命中都是新的 dict
+    story["nodes"].clear()
+    assert cache.lookup("The adventure.")[0] == STORY
+
+
+def test_semantic_hit_above_threshold(cache):
+    client = FakeClient({"original": unit(1, 0), "reformatted": unit(1, 0.01)})
+    cache.store("original", STORY, client.vectors["original"])
+
+    story, embedding = cache.lookup("reformatted", client)
+    assert story == STORY
+    assert embedding == client.vectors["reformatted"]
+    assert client.calls == {"emb": 1, "verify": 0}
+
+
+@pytest.mark.parametrize("answer, hit", [("yes", True), ("no", False)])
+def test_gray_zone_asks_verify_model(cache, answer, hit):
+    # cos ~= 0.90：落在 SEMANTIC_VERIFY 和 SEMANTIC_HIT 之间
+    client = FakeClient({"original": unit(1, 0), "edited": unit(1, 0.48)}, verify_answer=answer)
+    score = sum(a * b for a, b in zip(client.vectors["original"], client.vectors["edited"]))
+    assert story_cache_mod.SEMANTIC_VERIFY <= score < story_cache_mod.SEMANTIC_HIT
+    cache.store("original", STORY, client.vectors["original"])
+
+    story, embedding = cache.lookup("edited", client)
+    assert (story == STORY) is hit
+    assert embedding == client.vectors["edited"]
+    assert client.calls["verify"] == 1
+
+
+def test_low_similarity_misses_without_verify(cache):
+    client = FakeClient({"original": unit(1, 0), "other": unit(0, 1)})
+    cache.store("original", STORY, client.vectors["original"])
+
+    story, embedding = cache.lookup("other", client)
+    assert story is None
+    assert embedding == client.vectors["other"]
+    assert client.calls["verify"] == 0
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(story_cache_mod.time, "time", lambda: now[0])
+    cache = StoryCache(cache_dir=tmp_path, ttl=60)
+    cache.store("old adventure", STORY)
+    assert cache.lookup("old adventure")[0] == STORY
+
+    now[0] += 61
+    assert cache.lookup("old adventure")[0] is None
+    # 重新从磁盘载入时过期文件被删掉
+    assert StoryCache(cache_dir=tmp_path, ttl=60).lookup("old adventure")[0] is None
+    assert not (tmp_path / f"{text_key('old adventure')}.json").exists()
+
+
+def test_corrupt_entry_file_is_skipped(tmp_path):
+    StoryCache(cache_dir=tmp_path).store("good adventure", STORY)
+    (tmp_path / f"{text_key('broken adventure')}.json").write_bytes(b"{not json")
+    (tmp_path / f"{text_key('partial adventure')}.json").write_bytes(b'{"created": 1}')
+
+    cache = StoryCache(cache_dir=tmp_path)
+    assert cache.lookup("broken adventure")[0] is None
+    assert cache.lookup("partial adventure")[0] is None
+    assert cache.lookup("good adventure")[0] == STORY
@@ -15,97 +15,20 @@ Usage:
   python test_story_gen.py
 """
 
+import functools
 import os
 import json
 import re
 import logging
+import orjson
 from datetime import datetime
+import httpx
 from openai import OpenAI
 
 # Import your graph definition
 from app.engine.story import StoryGraph
 
-# ================== System Prompt (The Dungeon Architect) ==================
-SYSTEM_PROMPT = """
-# Role
-You are an expert AI Dungeon Master and Data Architect. Your task is to convert unstructured D&D adventure text into a fully structured, playable JSON Graph.
-
-# Core Directive: Inference & Completion
-The input text may be narrative and lack explicit structured data. **You must infer missing details based on context.**
-1. **Environment**: If the text says "stormy", infer `sound="Thunder"`, `light="Dim"`. If "cave", infer `light="Darkness"`.
-2. **Mechanics**: If the text implies a challenge (e.g., "persuade the guard"), you must create an `InteractionSpec` even if a specific DC isn't listed (estimate a standard DC based on difficulty).
-3. **Transitions**: If the text moves from one location to another without naming them, you must **invent** logical IDs (e.g., `scene_beach` -> `scene_temple`) and link them.
-
-# Data Structure Rules
-
-## 1. Scene Segmentation
-Break the text into a **JSON List** of Scene Nodes. Create a new node whenever:
-* The location changes.
-* A specific encounter (Combat/Social) begins.
-* The narrative "chapter" shifts.
-
-## 2. Field Extraction Guidelines
-* **id**: Snake_case unique identifier (e.g., `merrow_encounter`).
-* **type**: `encounter` (default), `roleplay`, `transition`, or `puzzle`.
-* **read_aloud**: Extract text meant to be read to players (often in quotes or specific blocks). **Do NOT** put rules or secrets here.
-* **gm_guidance**: Summarize DM-facing info, secrets, tactics, and "what happens if..." scenarios.
-* **environment**:
-    * `light`: "Bright", "Dim", "Darkness", etc. (Infer from time of day/weather).
-    * `terrain`: "Normal", "Difficult (Sand)", "Water", etc.
-    * `sound`: Inferred ambient sounds.
-* **entities**:
-    * Extract explicit enemies/NPCs.
-    * **Ignore** stat blocks (HP, AC). Only keep `name`, `count`, and generate a `ref_slug` (e.g., "Merrow" -> "merrow").
-    * Infer `disposition`: "hostile", "friendly", or "neutral".
-    * `state`: Initial position or activity (e.g., "Hiding", "Sleeping").
-* **interactions**:
-    * Convert text like "DC 15 Charisma check" into structured objects.
-    * Format: `{ "trigger": "Negotiate", "mechanic": "DC 15 Charisma", "success": "Cost reduced" }`
-* **loot**: If specific items are mentioned, list them. If none, use `[]`.
-
-# Output Format
-Return **ONLY** a valid JSON List. Do not wrap in markdown blocks if possible.
-
-[
-  {
-    "id": "unique_scene_id",
-    "title": "Scene Title",
-    "type": "encounter",
-    "read_aloud": "Flavor text...",
-    "gm_guidance": "DM secrets...",
-    "environment": {
-      "light": "Inferred Light",
-      "terrain": "Inferred Terrain",
-      "sound": "Inferred Sound"
-    },
-    "entities": [
-      {
-        "name": "Name",
-        "type": "monster",
-        "ref_slug": "slug",
-        "count": 1,
-        "state": "Initial state",
-        "disposition": "hostile"
-      }
-    ],
-    "interactions": [
-      {
-        "trigger": "Action",
-        "mechanic": "DC X Check",
-        "success": "Result"
-      }
-    ],
-    "loot": [],
-    "next": [
-      {
-        "to": "next_scene_id",
-        "label": "Transition trigger",
-        "condition": "Optional condition"
-      }
-    ]
-  }
-]
-"""
+from app.engine.prompts import SYSTEM_PROMPT, FEW_SHOT_MESSAGES
 
 # ================== Logger Setup ==================
 log_dir = "logs"
@@ -121,34 +44,53 @@ logging.basicConfig(
 
 # ================== Helper Functions ==================
 
+# Compiled once at import instead of going through re's pattern cache per call
+FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```")
+
 def clean_json_text(text: str) -> str:
     """
     LLMs often wrap JSON in ```json ... ``` blocks. 
-    This function strips them to ensure parsing works.
+    This function strips them (and any leading BOM) to ensure parsing works.
     """
+    text = text.strip(" \t\r\n\ufeff")
+    # Already bare JSON (the common case): skip the regex scan entirely
+    if text[:1] in ("[", "{"):
+        return text
     # Remove markdown code blocks
-    pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
-    match = re.search(pattern, text)
-    if match:
-        return match.group(1)
-    return text.strip()
+    match = FENCE_RE.search(text)
+    return match.group(1) if match else text
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> OpenAI:
+    """
+    One shared client: its httpx pool keeps the TLS connection to OpenAI alive between calls.
+    Built lazily so importing this module (e.g. pytest collection) needs no API key.
+    """
+    return OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        http_client=httpx.Client(limits=httpx.Limits(max_keepalive_connections=20)),
+    )
 
 def call_llm_generation(input_text: str) -> str:
     """
     Calls OpenAI to convert text -> JSON List.
     """
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    
+    client = get_client()
+
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"Please process the following adventure text:\n\n{input_text}"}
+        *FEW_SHOT_MESSAGES,
+        {"role": "user", "content": input_text}
     ]
 
     logging.info("Sending request to LLM...")
     response = client.chat.completions.create(
         model="gpt-4o",  # gpt-4o is highly recommended for complex schema inference
         messages=messages,
-        temperature=0.1, # Low temperature for consistent structure
+        temperature=0,  # Deterministic structure: same input -> same graph
+        top_p=1,
+        seed=42,
+        prompt_cache_key="story-architect-test-v1", # static system prefix -> same cache backend
     )
     return response.choices[0].message.content
 
@@ -308,7 +250,10 @@ Avoiding the Zombies. If the characters are faring poorly against the zombies or
         # 3. Load into Graph
         print(">>> 3. Loading into StoryGraph...")
         graph = StoryGraph()
-        nodes = graph.add_scenes_from_json_list(json_str)
+        data = json.loads(json_str)
+        if isinstance(data, dict):
+            data = data.get("scenes", [data])  # Output Format: {"scenes": [...]}
+        nodes = graph.add_scenes_from_parsed(data)
         
         print(f"    Success! Loaded {len(nodes)} scenes.")
         print(f"    Scene IDs: {graph.list_scene_ids()}")
@@ -342,8 +287,9 @@ Avoiding the Zombies. If the characters are faring poorly against the zombies or
 
         print(">>> 6. Saving to adventure_data.json...")     
         output_file = "adventure_data.json"                  
-        with open(output_file, "w", encoding="utf-8") as f:  
-            f.write(graph.to_json(indent=2))                 
+        # orjson emits UTF-8 bytes directly: no str -> encode round trip
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(graph.to_dict(), option=orjson.OPT_INDENT_2))
         print(f"    Saved successfully to {output_file}")    
 
 
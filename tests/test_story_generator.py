@@ -0,0 +1,121 @@
+# test_story_generator.py
+import os
+import sys
+import types
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+import pytest
+
+import app.services.story_generator as story_generator
+from app.config import STORIES_DIR
+from app.engine.story import StoryGraph
+from app.services.story_cache import StoryCache
+
+FIXTURE_STORY = STORIES_DIR / "056ecfef" / "story.json"
+
+
+def fake_client(text: str):
+    """流式返回固定文本的假 client，按 50 字符一块切开"""
+    def create(**kwargs):
+        return iter([
+            types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text[i:i + 50]))])
+            for i in range(0, len(text), 50)
+        ])
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    client.with_options = lambda **kwargs: client
+    return client
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+    # 关掉语义缓存、用临时目录的缓存，避免读写 data/story_cache
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(story_generator, "story_cache", StoryCache(cache_dir=tmp_path / "story_cache"))
+    return story_generator
+
+
+def test_generated_story_matches_story_graph_export(generator, monkeypatch):
+    scenes = list(orjson.loads(FIXTURE_STORY.read_bytes())["nodes"].values())
+    # 模拟没有 schema 约束的输出：缺省字段交给 StoryNode / StoryGraph 补默认值
+    for scene in scenes:
+        scene.get("environment", {}).pop("sound", None)
+        for entity in scene.get("entities", []):
+            entity.pop("extra", None)
+        for edge in scene.get("edges", []):
+            edge.pop("label", None)
+    llm_output = orjson.dumps({"scenes": scenes}).decode()
+    monkeypatch.setattr(generator, "get_client", lambda: fake_client(llm_output))
+
+    generated = generator.generate_story_from_text("fixture adventure text")
+
+    graph = StoryGraph()
+    graph.add_scenes_from_json_list(orjson.dumps(scenes).decode())
+    assert generated == graph.to_dict()
+    assert list(generated["nodes"]) == [s["id"] for s in scenes]
+
+
+def test_no_cache_bypasses_cached_story(generator, monkeypatch):
+    def scenes(title):
+        return orjson.dumps({"scenes": [{
+            "id": "start", "title": title, "type": "destination", "read_aloud": "", "gm_guidance": "",
+            "environment": {}, "entities": [], "options": [], "interactions": [], "edges": [],
+        }]}).decode()
+
+    monkeypatch.setattr(generator, "get_client", lambda: fake_client(scenes("First")))
+    first = generator.generate_story_from_text("same adventure")
+
+    monkeypatch.setattr(generator, "get_client", lambda: fake_client(scenes("Second")))
+    assert generator.generate_story_from_text("same adventure") == first
+
+    fresh = generator.generate_story_from_text("same adventure", no_cache=True)
+    assert fresh["nodes"]["start"]["title"] == "Second"
+    # 强制生成的结果覆盖了旧的缓存条目
+    assert generator.generate_story_from_text("same adventure") == fresh
+
+
+def scene(sid, *edges):
+    return {
+        "id": sid, "title": sid, "type": "destination", "read_aloud": "", "gm_guidance": "",
+        "environment": {}, "entities": [], "options": [], "interactions": [],
+        "edges": [{"to": to, "weight": 1.0, "label": "", "condition": None} for to in edges],
+    }
+
+
+def section_client(outputs):
+    """按 user 消息（即每段原文）的开头选择返回哪段输出"""
+    def create(messages, **kwargs):
+        user = messages[-1]["content"]
+        text = next(out for key, out in outputs.items() if user.startswith(key))
+        return iter([types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])])
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    client.with_options = lambda **kwargs: client
+    return client
+
+
+LONG_ADVENTURE = "# Part One\n" + "a " * 1100 + "\n\n# Part Two\n" + "b " * 1100
+
+
+def test_sections_with_duplicate_scene_ids_are_rejected(generator, monkeypatch):
+    assert len(generator.split_adventure_into_sections(LONG_ADVENTURE)) == 2
+    outputs = {
+        "# Part One": orjson.dumps({"scenes": [scene("part_one", "part_two"), scene("camp")]}).decode(),
+        "# Part Two": orjson.dumps({"scenes": [scene("part_two", "camp"), scene("camp")]}).decode(),
+    }
+    monkeypatch.setattr(generator, "get_client", lambda: section_client(outputs))
+
+    with pytest.raises(ValueError, match="Duplicate scene ids: camp"):
+        generator.generate_story_from_text(LONG_ADVENTURE)
+    assert generator.story_cache.lookup(LONG_ADVENTURE)[0] is None
+
+
+@pytest.mark.parametrize("scenes, message", [
+    ([scene("start", "missing")], "unknown scene 'missing'"),
+    ([scene("start", "end"), scene("end", "start")], "cycle"),
+])
+def test_broken_graph_is_not_cached(generator, monkeypatch, scenes, message):
+    monkeypatch.setattr(generator, "get_client", lambda: fake_client(orjson.dumps({"scenes": scenes}).decode()))
+
+    with pytest.raises(ValueError, match=message):
+        generator.generate_story_from_text("broken adventure")
+    assert generator.story_cache.lookup("broken adventure")[0] is None
@@ -1,5 +1,10 @@
 # test_story_graph.py
-from app.engine.story import StoryGraph
+import os
+import random
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.engine.story import SceneNode, StoryGraph
 
 def main():
     g = StoryGraph()
@@ -41,5 +46,85 @@ def main():
     print("Is DAG:", g.check_is_dag())
     print("JSON dump:\n", g.to_json())
 
+
+def make_graph(n, edges):
+    g = StoryGraph()
+    for i in range(n):
+        g.add_scene(SceneNode(id=f"s{i}", title=f"Scene {i}"))
+    for a, b in edges:
+        g.add_edge(f"s{a}", b if isinstance(b, str) else f"s{b}")
+    return g
+
+
+def test_dag_checks():
+    assert StoryGraph().check_is_dag()
+    assert make_graph(4, [(0, 1), (0, 2), (1, 3), (2, 3)]).check_is_dag()
+    assert not make_graph(3, [(0, 1), (1, 2), (2, 0)]).check_is_dag()
+    assert not make_graph(2, [(0, 1), (1, 1)]).check_is_dag()  # 自环
+
+
+def test_dangling_edges_are_reported_not_followed():
+    g = make_graph(2, [(0, 1), (1, "ghost")])
+    assert g.check_is_dag()
+    assert g.validate_graph() == ["Scene 's1' has an edge to unknown scene 'ghost'"]
+
+
+def test_add_edge_after_index_is_built():
+    g = make_graph(3, [(0, 1), (1, 2)])
+    assert g.check_is_dag()  # 建好整数索引
+    assert g.validate_graph() == []
+
+    g.add_edge("s2", "ghost")  # 增量记入悬空边
+    assert g.validate_graph() == ["Scene 's2' has an edge to unknown scene 'ghost'"]
+    assert g.check_is_dag()
+
+    g.add_edge("s2", "s0")  # 增量加入邻接表，形成环
+    assert not g.check_is_dag()
+
+
+def test_add_scene_invalidates_index():
+    g = make_graph(2, [(0, 1), (1, "s2")])
+    assert g.validate_graph() == ["Scene 's1' has an edge to unknown scene 's2'"]
+    g.add_scene(SceneNode(id="s2", title="Scene 2"))
+    assert g.validate_graph() == []
+    g.add_edge("s2", "s0")
+    assert not g.check_is_dag()
+
+
+def _has_cycle_reference(n, edges):
+    """对照实现：递归 DFS 三色标记"""
+    adj = {i: [b for a, b in edges if a == i] for i in range(n)}
+    state = [0] * n
+
+    def visit(i):
+        state[i] = 1
+        for j in adj[i]:
+            if state[j] == 1 or (state[j] == 0 and visit(j)):
+                return True
+        state[i] = 2
+        return False
+
+    return any(state[i] == 0 and visit(i) for i in range(n))
+
+
+def test_check_is_dag_matches_reference_on_random_graphs():
+    rng = random.Random(7)
+    for _ in range(200):
+        n = rng.randint(1, 12)
+        edges = [(rng.randrange(n), rng.randrange(n)) for _ in range(rng.randint(0, 2 * n))]
+        assert make_graph(n, edges).check_is_dag() == (not _has_cycle_reference(n, edges)), (n, edges)
+
+
 if __name__ == "__main__":
     main()
+
+
+def test_null_edge_label_becomes_empty_string():
+    graph = StoryGraph()
+    graph.add_scenes_from_parsed([{
+        "id": "start", "title": "Start", "type": "destination", "read_aloud": "", "gm_guidance": "",
+        "environment": {}, "entities": [], "options": [], "interactions": [],
+        "edges": [{"to": "start", "label": None}],
+    }])
+    assert graph.nodes["start"].edges[0].label == ""
+    assert "start --> start" in graph.to_mermaid()